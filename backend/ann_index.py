@@ -0,0 +1,259 @@
+import argparse
+import os
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from vector_index import FlatIndex, normalize_rows, top_k_indices
+
+# Below this many vectors an IVF index just searches its rows exactly
+IVF_MIN_TRAIN_SIZE = int(os.getenv("IVF_MIN_TRAIN_SIZE", "4096"))
+IVF_MAX_LISTS = int(os.getenv("IVF_MAX_LISTS", "1024"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Retrain the coarse quantizer once the index has grown this many times past its training size
+IVF_RETRAIN_GROWTH = float(os.getenv("IVF_RETRAIN_GROWTH", "4"))
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, spherical: bool = True,
+                        block_rows: int = 8192) -> np.ndarray:
+    """Index of the nearest centroid for every vector, computed block-wise to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    if not spherical:
+        centroid_norms = (centroids ** 2).sum(axis=1)
+
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        scores = block @ centroids.T
+        if spherical:
+            assignments[start:start + len(block)] = np.argmax(scores, axis=1)
+        else:
+            # argmin ||x - c||^2 == argmin ||c||^2 - 2 x.c
+            assignments[start:start + len(block)] = np.argmin(centroid_norms - 2 * scores, axis=1)
+    return assignments
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, spherical: bool = True,
+           seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; spherical mode clusters by cosine and returns unit-length centroids"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids, spherical)
+
+        # Per-cluster sums via one sort + reduceat instead of a Python loop
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        occupied = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[occupied] = np.add.reduceat(vectors[order], starts[occupied], axis=0)
+
+        if spherical:
+            centroids[occupied] = normalize_rows(sums[occupied])
+        else:
+            centroids[occupied] = sums[occupied] / counts[occupied, None]
+
+        # Re-seed empty clusters from random vectors so no list stays unused
+        empty = np.flatnonzero(~occupied)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+    return centroids
+
+
+class IVFFlatIndex:
+    """Inverted-file index: a k-means coarse quantizer over per-list FlatIndexes.
+
+    A query is scored against the centroids first and only the nprobe closest
+    lists are scanned exactly, so latency grows with N / nlist * nprobe rather
+    than N. Only the centroids are persisted; on restart the stored vectors are
+    re-assigned to them, which is a single pass instead of a k-means rebuild.
+    """
+
+    def __init__(self, path: Optional[str] = None, nprobe: int = IVF_NPROBE,
+                 min_train_size: int = IVF_MIN_TRAIN_SIZE, max_lists: int = IVF_MAX_LISTS):
+        self.path = path
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.max_lists = max_lists
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[FlatIndex] = []
+        self._pending = FlatIndex()  # rows held exactly until there are enough to train on
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+        if path and os.path.exists(path):
+            with np.load(path) as saved:
+                self.centroids = saved["centroids"]
+                self._trained_size = int(saved["trained_size"])
+            self._lists = [FlatIndex(self.centroids.shape[1]) for _ in range(len(self.centroids))]
+
+    def __len__(self) -> int:
+        return len(self._pending) + sum(len(inverted_list) for inverted_list in self._lists)
+
+    def add(self, ids: List[str], document_ids: List[str], embeddings: np.ndarray, train: bool = True):
+        """Insert vectors into their nearest lists.
+
+        With train=True the quantizer is (re)trained as soon as the index is
+        large enough; bulk loads pass False and call train_if_needed once at the end.
+        """
+        if len(ids) == 0:
+            return
+
+        vectors = normalize_rows(embeddings)
+        with self._lock:
+            if self.centroids is not None and vectors.shape[1] != self.centroids.shape[1]:
+                self._reset()  # saved centroids belong to a different embedding model
+
+            if self.centroids is None:
+                self._pending.add(ids, document_ids, vectors)
+            else:
+                self._assign(np.asarray(ids, dtype=object), np.asarray(document_ids, dtype=object), vectors)
+
+            if train:
+                self.train_if_needed()
+
+    def train_if_needed(self):
+        """Train once there are enough rows, and retrain after substantial growth"""
+        with self._lock:
+            if self.centroids is None:
+                if len(self._pending) >= self.min_train_size:
+                    self.train()
+            elif len(self) >= IVF_RETRAIN_GROWTH * max(self._trained_size, self.min_train_size):
+                self.train()
+
+    def _assign(self, ids: np.ndarray, document_ids: np.ndarray, vectors: np.ndarray):
+        assignments = assign_to_centroids(vectors, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        for list_id, start, end in zip(lists, bounds[:-1], bounds[1:]):
+            rows = order[start:end]
+            self._lists[list_id].add(ids[rows], document_ids[rows], vectors[rows])
+
+    def _reset(self):
+        ids, document_ids, vectors = self._all_rows()
+        self.centroids = None
+        self._lists = []
+        self._trained_size = 0
+        self._pending = FlatIndex()
+        if len(ids):
+            self._pending.add(ids, document_ids, vectors)
+
+    def _all_rows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        parts = [index.rows() for index in [self._pending] + self._lists if len(index)]
+        if not parts:
+            return np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32)
+        return (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]),
+                np.concatenate([p[2] for p in parts]))
+
+    def train(self, sample_per_list: int = 64):
+        """(Re)fit the coarse quantizer on the current rows, redistribute them and persist the centroids"""
+        with self._lock:
+            ids, document_ids, vectors = self._all_rows()
+            if not len(ids):
+                return
+
+            nlist = int(np.clip(4 * np.sqrt(len(ids)), 1, self.max_lists))
+            rng = np.random.default_rng(0)
+            sample_size = min(len(vectors), nlist * sample_per_list)
+            sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+            self.centroids = kmeans(sample, nlist, spherical=True)
+            self._lists = [FlatIndex(vectors.shape[1]) for _ in range(len(self.centroids))]
+            self._pending = FlatIndex()
+            self._trained_size = len(ids)
+            self._assign(ids, document_ids, vectors)
+
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                # Write-then-rename so a crash never leaves a truncated file behind
+                temp_path = self.path + ".tmp.npz"
+                np.savez(temp_path, centroids=self.centroids, trained_size=self._trained_size)
+                os.replace(temp_path, self.path)
+
+    def remove_document(self, document_id: str) -> int:
+        """Drop every row belonging to a document, returning the number removed"""
+        with self._lock:
+            return sum(index.remove_document(document_id) for index in [self._pending] + self._lists)
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Approximate top_k search over the nprobe lists whose centroids are closest to the query"""
+        with self._lock:
+            centroids = self.centroids
+            lists = list(self._lists)
+            pending = self._pending
+
+        hits = pending.search(query_embedding, top_k)
+        if centroids is not None:
+            query = normalize_rows(query_embedding)[0]
+            probe = top_k_indices(centroids @ query, nprobe or self.nprobe)
+            for list_id in probe:
+                hits.extend(lists[list_id].search(query, top_k))
+
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+
+def evaluate_recall(index: IVFFlatIndex, exact: FlatIndex, queries: np.ndarray, top_k: int = 5,
+                    nprobe_values: Optional[List[int]] = None) -> List[Dict]:
+    """Measure recall@top_k and mean latency of an IVF index against brute force, per nprobe"""
+    nprobe_values = nprobe_values or [1, 2, 4, 8, 16, 32]
+
+    exact_hits = []
+    start = time.perf_counter()
+    for query in queries:
+        exact_hits.append({chunk_id for chunk_id, _ in exact.search(query, top_k)})
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobe_values:
+        found = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact_hits):
+            found += len(expected & {chunk_id for chunk_id, _ in index.search(query, top_k, nprobe=nprobe)})
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report.append({
+            'nprobe': nprobe,
+            'recall': found / max(1, sum(len(expected) for expected in exact_hits)),
+            'latency_ms': elapsed_ms,
+            'brute_force_latency_ms': exact_ms
+        })
+    return report
+
+
+if __name__ == "__main__":
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description="Recall-vs-brute-force report for the IVF index")
+    parser.add_argument("--db", default="vector_store.db")
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.05,
+                        help="Gaussian noise added to sampled stored vectors to form queries")
+    args = parser.parse_args()
+
+    exact = FlatIndex()
+    for batch in VectorStore(args.db, index_type="flat").iter_embeddings(args.user_id):
+        exact.add(*batch)
+    ids, document_ids, vectors = exact.rows()
+    if not len(ids):
+        raise SystemExit("No embeddings found")
+
+    ivf = IVFFlatIndex(min_train_size=1)
+    ivf.add(ids, document_ids, vectors)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+
+    print(f"{len(ids)} vectors, {len(ivf.centroids)} lists, top_k={args.top_k}")
+    print(f"{'nprobe':>8} {'recall':>8} {'ivf ms':>10} {'exact ms':>10}")
+    for row in evaluate_recall(ivf, exact, queries, args.top_k):
+        print(f"{row['nprobe']:>8} {row['recall']:>8.3f} {row['latency_ms']:>10.3f} {row['brute_force_latency_ms']:>10.3f}")
@@ -4,19 +4,25 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from pydantic import BaseModel, EmailStr, validator
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import os
 import secrets
 import hashlib
 import asyncio
+import threading
+import time
 from email_validator import validate_email, EmailNotValidError
 import re
 import sqlite3
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.datastructures import MutableHeaders
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from cache import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, BloomFilter, LRUCache
+from db import ConnectionPool
 
 # Load environment variables
 load_dotenv()
@@ -29,9 +35,30 @@ REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 MAX_LOGIN_ATTEMPTS = int(os.getenv("MAX_LOGIN_ATTEMPTS", "5"))
 LOCKOUT_DURATION_MINUTES = int(os.getenv("LOCKOUT_DURATION_MINUTES", "15"))
 
+# Revoked tokens are mirrored into an in-memory Bloom filter so that checking a
+# token that was never revoked (nearly all of them) needs no query. Revocations
+# made by other worker processes are picked up at most this often.
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "1"))
+REVOKED_TOKEN_FILTER_CAPACITY = int(os.getenv("REVOKED_TOKEN_FILTER_CAPACITY", "100000"))
+REVOKED_TOKEN_FILTER_ERROR_RATE = float(os.getenv("REVOKED_TOKEN_FILTER_ERROR_RATE", "0.001"))
+# Failed sign-ins are counted in memory; each email's window is reloaded from
+# login_attempts this often so other worker processes' failures count too
+LOGIN_COUNTER_SYNC_SECONDS = float(os.getenv("LOGIN_COUNTER_SYNC_SECONDS", "5"))
+LOGIN_COUNTER_MAX_EMAILS = int(os.getenv("LOGIN_COUNTER_MAX_EMAILS", "100000"))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+# Operational endpoints (/metrics and the */stats pages) take a shared key rather than a user token
+stats_security = HTTPBearer(auto_error=False)
+
+# Bearer key for the operational endpoints; while unset they are disabled
+STATS_API_KEY = os.getenv("STATS_API_KEY", "")
+
+# bcrypt runs on its own small pool; beyond workers + queue, sign-ins are rejected with 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", "2"))
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -103,219 +130,412 @@ class UserProfile(BaseModel):
 
 class AuthDatabase:
     def __init__(self):
+        # Every authenticated request reads this database, so connections are pooled
+        self.pool = ConnectionPool(DB_PATH, foreign_keys=True)
+        self._revoked_filter = BloomFilter(REVOKED_TOKEN_FILTER_CAPACITY, REVOKED_TOKEN_FILTER_ERROR_RATE)
+        self._revoked_seen_id = 0
+        self._revoked_synced_at = 0.0
+        self._revoked_lock = threading.Lock()
+        # email -> (loaded at, timestamps of failed attempts inside the lockout window)
+        self._failed_logins: "OrderedDict[str, tuple]" = OrderedDict()
+        self._failed_logins_lock = threading.Lock()
         self.init_db()
+        self._rebuild_revoked_filter()
     
     def init_db(self):
         """Initialize the authentication database"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                full_name TEXT NOT NULL,
-                is_active BOOLEAN DEFAULT TRUE,
-                email_verified BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                password_reset_token TEXT,
-                password_reset_expires TIMESTAMP
-            )
-        ''')
-        
-        # Login attempts table for rate limiting
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS login_attempts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT NOT NULL,
-                ip_address TEXT,
-                attempted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                success BOOLEAN DEFAULT FALSE
-            )
-        ''')
-        
-        # Active tokens table for token blacklisting
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                token_hash TEXT NOT NULL,
-                token_type TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    email TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    full_name TEXT NOT NULL,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    email_verified BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP,
+                    password_reset_token TEXT,
+                    password_reset_expires TIMESTAMP
+                )
+            ''')
+            
+            # Login attempts table for rate limiting
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS login_attempts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    email TEXT NOT NULL,
+                    ip_address TEXT,
+                    attempted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    success BOOLEAN DEFAULT FALSE
+                )
+            ''')
+            
+            # Active tokens table for token blacklisting
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS active_tokens (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    token_hash TEXT NOT NULL,
+                    token_type TEXT NOT NULL,
+                    expires_at TIMESTAMP NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            # Revoked tokens until they expire; the source of the in-memory revocation filter
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    token_hash TEXT NOT NULL,
+                    expires_at TIMESTAMP NOT NULL
+                )
+            ''')
+            
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_hash ON active_tokens (token_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_user ON active_tokens (user_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_expires ON active_tokens (expires_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attempt_email ON login_attempts (email, success, attempted_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attempt_time ON login_attempts (attempted_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_revoked_expires ON revoked_tokens (expires_at)")
     
     def get_connection(self):
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Borrow a pooled connection returning sqlite3.Row rows; use as a context manager"""
+        return self.pool.connection(sqlite3.Row)
     
     def create_user(self, email: str, password_hash: str, full_name: str) -> int:
         """Create a new user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute(
-                "INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)",
-                (email.lower(), password_hash, full_name)
-            )
-            user_id = cursor.lastrowid
-            conn.commit()
-            return user_id
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)",
+                    (email.lower(), password_hash, full_name)
+                )
+                return cursor.lastrowid
         except sqlite3.IntegrityError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
-        finally:
-            conn.close()
     
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user by email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email.lower(),))
-        user = cursor.fetchone()
-        conn.close()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE email = ?", (email.lower(),))
+            user = cursor.fetchone()
         
         return dict(user) if user else None
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
         
         return dict(user) if user else None
     
     def update_last_login(self, user_id: int):
         """Update user's last login timestamp"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
-            (user_id,)
-        )
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
+                (user_id,)
+            )
     
     def log_login_attempt(self, email: str, ip_address: str, success: bool):
         """Log login attempt"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.get_connection() as conn:
+            conn.execute(
+                "INSERT INTO login_attempts (email, ip_address, success) VALUES (?, ?, ?)",
+                (email.lower(), ip_address, success)
+            )
         
-        cursor.execute(
-            "INSERT INTO login_attempts (email, ip_address, success) VALUES (?, ?, ?)",
-            (email.lower(), ip_address, success)
-        )
-        conn.commit()
-        conn.close()
+        if not success:
+            with self._failed_logins_lock:
+                entry = self._failed_logins.get(email.lower())
+                if entry is not None:
+                    entry[1].append(time.time())
     
     def get_failed_login_attempts(self, email: str, minutes: int = None) -> int:
         """Get failed login attempts count"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if minutes:
-            cursor.execute('''
-                SELECT COUNT(*) FROM login_attempts 
-                WHERE email = ? AND success = FALSE 
-                AND attempted_at > datetime('now', '-{} minutes')
-            '''.format(minutes), (email.lower(),))
-        else:
-            cursor.execute(
-                "SELECT COUNT(*) FROM login_attempts WHERE email = ? AND success = FALSE",
-                (email.lower(),)
-            )
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        if minutes and minutes <= LOCKOUT_DURATION_MINUTES:
+            cutoff = time.time() - minutes * 60
+            return sum(1 for attempted_at in self._recent_failures(email.lower()) if attempted_at > cutoff)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if minutes:
+                cursor.execute('''
+                    SELECT COUNT(*) FROM login_attempts 
+                    WHERE email = ? AND success = FALSE 
+                    AND attempted_at > datetime('now', ?)
+                ''', (email.lower(), f"-{minutes} minutes"))
+            else:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM login_attempts WHERE email = ? AND success = FALSE",
+                    (email.lower(),)
+                )
+            return cursor.fetchone()[0]
+    
+    def _recent_failures(self, email: str) -> List[float]:
+        """Timestamps of the email's failed attempts within the lockout window, served from memory"""
+        now = time.time()
+        window_start = now - LOCKOUT_DURATION_MINUTES * 60
+        with self._failed_logins_lock:
+            entry = self._failed_logins.get(email)
+            if entry is not None and now - entry[0] < LOGIN_COUNTER_SYNC_SECONDS:
+                attempts = entry[1]
+                while attempts and attempts[0] <= window_start:
+                    attempts.popleft()
+                self._failed_logins.move_to_end(email)
+                return list(attempts)
+        
+        with self.get_connection() as conn:
+            rows = conn.execute('''
+                SELECT CAST(strftime('%s', attempted_at) AS INTEGER) FROM login_attempts
+                WHERE email = ? AND success = FALSE AND attempted_at > datetime(?, 'unixepoch')
+                ORDER BY attempted_at
+            ''', (email, int(window_start))).fetchall()
+        attempts = deque(float(row[0]) for row in rows)
+        
+        with self._failed_logins_lock:
+            self._failed_logins[email] = (now, attempts)
+            self._failed_logins.move_to_end(email)
+            while len(self._failed_logins) > LOGIN_COUNTER_MAX_EMAILS:
+                self._failed_logins.popitem(last=False)
+        return list(attempts)
     
     def clear_login_attempts(self, email: str):
         """Clear login attempts for user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM login_attempts WHERE email = ?", (email.lower(),))
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            conn.execute("DELETE FROM login_attempts WHERE email = ?", (email.lower(),))
+        with self._failed_logins_lock:
+            self._failed_logins.pop(email.lower(), None)
     
     def store_token(self, user_id: int, token: str, token_type: str, expires_at: datetime):
         """Store active token"""
         token_hash = hashlib.sha256(token.encode()).hexdigest()
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO active_tokens (user_id, token_hash, token_type, expires_at) VALUES (?, ?, ?, ?)",
-            (user_id, token_hash, token_type, expires_at)
-        )
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            conn.execute(
+                "INSERT INTO active_tokens (user_id, token_hash, token_type, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, token_hash, token_type, expires_at)
+            )
     
     def is_token_blacklisted(self, token: str) -> bool:
         """Check if token is blacklisted"""
         token_hash = hashlib.sha256(token.encode()).hexdigest()
-        conn = self.get_connection()
-        cursor = conn.cursor()
         
-        cursor.execute(
-            "SELECT COUNT(*) FROM active_tokens WHERE token_hash = ? AND expires_at > CURRENT_TIMESTAMP",
-            (token_hash,)
-        )
-        count = cursor.fetchone()[0]
-        conn.close()
+        # Every issued token is stored, and only revocation removes one before it
+        # expires (expiry itself is enforced by the JWT), so a token the filter
+        # has never seen revoked is still active
+        self._sync_revoked_filter()
+        if token_hash not in self._revoked_filter:
+            return False
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM active_tokens WHERE token_hash = ? AND expires_at > CURRENT_TIMESTAMP",
+                (token_hash,)
+            )
+            count = cursor.fetchone()[0]
         return count == 0
     
     def revoke_token(self, token: str):
         """Revoke a token"""
         token_hash = hashlib.sha256(token.encode()).hexdigest()
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM active_tokens WHERE token_hash = ?", (token_hash,))
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            conn.execute('''
+                INSERT INTO revoked_tokens (token_hash, expires_at)
+                SELECT token_hash, expires_at FROM active_tokens WHERE token_hash = ?
+            ''', (token_hash,))
+            conn.execute("DELETE FROM active_tokens WHERE token_hash = ?", (token_hash,))
+        self._add_revoked([token_hash])
+    
+    def revoke_user_tokens(self, user_id: int):
+        """Revoke every token issued to a user"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT token_hash FROM active_tokens WHERE user_id = ?", (user_id,))
+            token_hashes = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''
+                INSERT INTO revoked_tokens (token_hash, expires_at)
+                SELECT token_hash, expires_at FROM active_tokens WHERE user_id = ?
+            ''', (user_id,))
+            cursor.execute("DELETE FROM active_tokens WHERE user_id = ?", (user_id,))
+        self._add_revoked(token_hashes)
+    
+    def _add_revoked(self, token_hashes: List[str]):
+        with self._revoked_lock:
+            for token_hash in token_hashes:
+                self._revoked_filter.add(token_hash)
+    
+    def _sync_revoked_filter(self):
+        """Fold in revocations recorded since the last sync (e.g. by other worker processes)"""
+        now = time.monotonic()
+        if now - self._revoked_synced_at < REVOCATION_SYNC_SECONDS:
+            return
+        with self._revoked_lock:
+            if now - self._revoked_synced_at < REVOCATION_SYNC_SECONDS:
+                return
+            with self.get_connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, token_hash FROM revoked_tokens WHERE id > ? ORDER BY id",
+                    (self._revoked_seen_id,)
+                ).fetchall()
+            for row in rows:
+                self._revoked_filter.add(row["token_hash"])
+            if rows:
+                self._revoked_seen_id = rows[-1]["id"]
+            self._revoked_synced_at = now
+        
+        if self._revoked_filter.count > self._revoked_filter.capacity:
+            self._rebuild_revoked_filter()
+    
+    def _rebuild_revoked_filter(self):
+        """Rebuild the filter from unexpired revocations, growing it if it has filled up"""
+        with self._revoked_lock:
+            with self.get_connection() as conn:
+                rows = conn.execute("SELECT id, token_hash FROM revoked_tokens ORDER BY id").fetchall()
+            revoked_filter = BloomFilter(max(REVOKED_TOKEN_FILTER_CAPACITY, 2 * len(rows)),
+                                         REVOKED_TOKEN_FILTER_ERROR_RATE)
+            for row in rows:
+                revoked_filter.add(row["token_hash"])
+            # Never move the high-water mark back: rows deleted by cleanup can leave it above the remaining ids
+            if rows:
+                self._revoked_seen_id = max(self._revoked_seen_id, rows[-1]["id"])
+            self._revoked_filter = revoked_filter
+            self._revoked_synced_at = time.monotonic()
+    
+    def set_user_active(self, user_id: int, is_active: bool):
+        """Activate or deactivate a user account"""
+        with self.get_connection() as conn:
+            conn.execute("UPDATE users SET is_active = ? WHERE id = ?", (is_active, user_id))
     
     def cleanup_expired_tokens(self):
         """Clean up expired tokens"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM active_tokens WHERE expires_at <= CURRENT_TIMESTAMP")
-        cursor.execute("DELETE FROM login_attempts WHERE attempted_at < datetime('now', '-7 days')")
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM active_tokens WHERE expires_at <= CURRENT_TIMESTAMP")
+            cursor.execute("DELETE FROM revoked_tokens WHERE expires_at <= CURRENT_TIMESTAMP")
+            cursor.execute("DELETE FROM login_attempts WHERE attempted_at < datetime('now', '-7 days')")
+        
+        # Expired revocations no longer need to be matched
+        self._rebuild_revoked_filter()
+        with self._failed_logins_lock:
+            window_start = time.time() - LOCKOUT_DURATION_MINUTES * 60
+            for email in [email for email, (_, attempts) in self._failed_logins.items()
+                          if not attempts or attempts[-1] <= window_start]:
+                del self._failed_logins[email]
 
 # Initialize database
 auth_db = AuthDatabase()
 
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    return {
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1]
+    }
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, bounded thread pool so it never blocks the event loop.
+    
+    bcrypt is slow by design; at most workers + max_queue operations are
+    admitted and the rest are refused with a 503 straight away, so a login
+    storm queues behind itself instead of stalling every other request.
+    """
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 context: CryptContext = pwd_context):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.context = context
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        # Recent samples in milliseconds
+        self._hash_ms = deque(maxlen=1024)
+        self._queue_wait_ms = deque(maxlen=1024)
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, plain_password, hashed_password)
+    
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._admitted >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many sign-in requests right now, please try again shortly",
+                    headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)}
+                )
+            self._admitted += 1
+        
+        submitted = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            return func(*args), started, time.perf_counter()
+        
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            with self._lock:
+                self._admitted -= 1
+        
+        with self._lock:
+            self.completed += 1
+            self._queue_wait_ms.append((started - submitted) * 1000)
+            self._hash_ms.append((finished - started) * 1000)
+        return result
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._admitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'hash_ms': _latency_summary(list(self._hash_ms)),
+                'queue_wait_ms': _latency_summary(list(self._queue_wait_ms))
+            }
+    
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 class AuthManager:
     def __init__(self):
         self.db = auth_db
+        self.password_hasher = PasswordHasher()
+        # Hot path of every protected endpoint: verified token payloads by raw
+        # token, and built profiles by user id, so neither needs a database query
+        self.token_cache = LRUCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+        self.principal_cache = LRUCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
     
-    def hash_password(self, password: str) -> str:
-        """Hash password using bcrypt"""
-        return pwd_context.hash(password)
+    async def hash_password(self, password: str) -> str:
+        """Hash password using bcrypt, on the bounded password hashing pool"""
+        return await self.password_hasher.hash(password)
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify password against hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify password against hash, on the bounded password hashing pool"""
+        return await self.password_hasher.verify(plain_password, hashed_password)
     
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None):
         """Create JWT access token"""
@@ -343,15 +563,23 @@ class AuthManager:
     
     def verify_token(self, token: str, token_type: str = "access"):
         """Verify JWT token"""
+        payload = self.token_cache.get(token)
+        if payload is not None and payload["exp"] <= time.time():
+            self.token_cache.pop(token)
+            payload = None
+        
         try:
-            # Check if token is blacklisted
-            if self.db.is_token_blacklisted(token):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Token has been revoked"
-                )
+            if payload is None:
+                # Check if token is blacklisted
+                if self.db.is_token_blacklisted(token):
+                    raise HTTPException(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        detail="Token has been revoked"
+                    )
+                
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                self.token_cache.put(token, payload)
             
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             if payload.get("type") != token_type:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -383,7 +611,7 @@ class AuthManager:
             )
         
         # Hash password
-        password_hash = self.hash_password(user_data.password)
+        password_hash = await self.hash_password(user_data.password)
         
         # Create user
         user_id = self.db.create_user(
@@ -459,7 +687,7 @@ class AuthManager:
             )
         
         # Verify password
-        if not self.verify_password(user_data.password, user["password_hash"]):
+        if not await self.verify_password(user_data.password, user["password_hash"]):
             self.db.log_login_attempt(user_data.email, ip_address, False)
             await asyncio.sleep(0.5)  # Prevent timing attacks
             raise HTTPException(
@@ -489,6 +717,7 @@ class AuthManager:
         
         # Update last login
         self.db.update_last_login(user["id"])
+        self.invalidate_user(user["id"])
         
         # Log successful login
         self.db.log_login_attempt(user_data.email, ip_address, True)
@@ -534,13 +763,30 @@ class AuthManager:
     async def logout(self, token: str):
         """Logout user and revoke token"""
         self.db.revoke_token(token)
+        self.token_cache.pop(token)
         logger.info("User logged out successfully")
     
+    def deactivate_user(self, user_id: int):
+        """Deactivate an account and revoke all of its tokens"""
+        self.db.set_user_active(user_id, False)
+        self.db.revoke_user_tokens(user_id)
+        # Cached tokens of this user now fail the profile check, which reloads from the database
+        self.invalidate_user(user_id)
+        logger.info(f"User deactivated: {user_id}")
+    
+    def invalidate_user(self, user_id: int):
+        """Drop a cached profile after the user's row changes"""
+        self.principal_cache.pop(user_id)
+    
     async def get_current_user(self, credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserProfile:
         """Get current authenticated user"""
         payload = self.verify_token(credentials.credentials)
         user_id = int(payload.get("sub"))
         
+        profile = self.principal_cache.get(user_id)
+        if profile is not None:
+            return profile
+        
         user = self.db.get_user_by_id(user_id)
         if not user:
             raise HTTPException(
@@ -554,7 +800,7 @@ class AuthManager:
                 detail="User account is deactivated"
             )
         
-        return UserProfile(
+        profile = UserProfile(
             id=user["id"],
             email=user["email"],
             full_name=user["full_name"],
@@ -562,6 +808,8 @@ class AuthManager:
             created_at=datetime.fromisoformat(user["created_at"]),
             last_login=datetime.fromisoformat(user["last_login"]) if user["last_login"] else None
         )
+        self.principal_cache.put(user_id, profile)
+        return profile
 
 # Initialize auth manager
 auth_manager = AuthManager()
@@ -580,18 +828,41 @@ async def get_current_active_user(current_user: UserProfile = Depends(get_curren
         )
     return current_user
 
-# Middleware for rate limiting and security headers
-class SecurityMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        
-        # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        return response
+async def require_stats_access(credentials: Optional[HTTPAuthorizationCredentials] = Depends(stats_security)):
+    """Dependency for operational endpoints: they expose auth and load counters, so no user may read them"""
+    if not STATS_API_KEY:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, STATS_API_KEY):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid stats key",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+# Middleware for security headers; rate limits are enforced per route (see rate_limit.py)
+class SecurityMiddleware:
+    """Pure ASGI middleware: headers are added to the response start message, so
+    streaming bodies pass through untouched instead of being re-wrapped"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # Add security headers
+                headers = MutableHeaders(scope=message)
+                headers["X-Content-Type-Options"] = "nosniff"
+                headers["X-Frame-Options"] = "DENY"
+                headers["X-XSS-Protection"] = "1; mode=block"
+                headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
 
 # Cleanup task
 async def cleanup_expired_data():
@@ -0,0 +1,398 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from vector_store import VectorStore
+
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)
+BENCHMARK_DIM = int(os.getenv("BENCHMARK_DIM", "1024"))  # bge-m3's dimension
+# Synthetic documents are stored this many chunks per document, and this many documents per transaction
+BENCHMARK_CHUNKS_PER_DOCUMENT = 500
+BENCHMARK_DOCUMENTS_PER_BATCH = 4
+BENCHMARK_CHUNK_WORDS = 60
+BENCHMARK_USER_ID = 1
+
+# Metrics where a larger number is an improvement; everything else numeric is a cost
+HIGHER_IS_BETTER = ("per_second", "qps")
+
+class StubEmbeddingGenerator:
+    """Deterministic stand-in for EmbeddingGenerator that needs no model download.
+
+    Each text maps to a fixed pseudo-random unit vector seeded by its hash, so
+    runs are reproducible and identical texts embed identically (as the
+    content-addressed embedding reuse expects). Similarity carries no meaning.
+    """
+
+    def __init__(self, dim: int = BENCHMARK_DIM):
+        self.dim = dim
+        self.model_name = f"stub-{dim}"
+
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+            embeddings[row] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def generate_single_embedding(self, text: str) -> np.ndarray:
+        return self.generate_embeddings([text])[0]
+
+    def get_embedding_dimension(self) -> int:
+        return self.dim
+
+class SyntheticText:
+    """Zipf-distributed words over a fixed random vocabulary, so full-text search sees realistic term statistics"""
+
+    def __init__(self, rng: np.random.Generator, vocabulary_size: int = 20_000):
+        letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+        lengths = rng.integers(3, 11, size=vocabulary_size)
+        self.words = np.array(["".join(rng.choice(letters, size=length)) for length in lengths])
+        weights = 1.0 / np.arange(1, vocabulary_size + 1)
+        self.probabilities = weights / weights.sum()
+        self.rng = rng
+
+    def sentence(self, words: int) -> str:
+        return " ".join(self.rng.choice(self.words, size=words, p=self.probabilities))
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """Percentiles of per-call latencies, in milliseconds"""
+    ms = np.asarray(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'max_ms': float(ms.max()),
+        'qps': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else 0.0
+    }
+
+def clustered_embeddings(rng: np.random.Generator, centers: np.ndarray, count: int) -> np.ndarray:
+    """Random vectors around a fixed set of centers, so ANN indexes see structure like real embeddings do"""
+    assignment = rng.integers(0, len(centers), size=count)
+    embeddings = centers[assignment] + 0.5 * rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def synthetic_documents(size: int, text: SyntheticText, rng: np.random.Generator, centers: np.ndarray,
+                        embedder: Optional[StubEmbeddingGenerator]) -> Iterator[Tuple[str, str, List[str], np.ndarray]]:
+    """Yield (document_hash, filename, chunks, embeddings) until size chunks have been produced"""
+    produced = 0
+    document = 0
+    while produced < size:
+        count = min(BENCHMARK_CHUNKS_PER_DOCUMENT, size - produced)
+        # The document number keeps chunks unique even if the generated words repeat
+        chunks = [f"{document}-{i} {text.sentence(BENCHMARK_CHUNK_WORDS)}" for i in range(count)]
+        embeddings = (embedder.generate_embeddings(chunks) if embedder is not None
+                      else clustered_embeddings(rng, centers, count))
+        yield hashlib.md5(f"synthetic-{size}-{document}".encode()).hexdigest(), f"synthetic-{document}.pdf", \
+            chunks, embeddings
+        produced += count
+        document += 1
+
+def write_synthetic_pdf(path: Path, pages: int, text: SyntheticText, lines_per_page: int = 45,
+                        words_per_line: int = 12):
+    """Write a plain text-only PDF (Helvetica, one content stream per page) that PyPDF2 can extract"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = [text.sentence(words_per_line) for _ in range(lines_per_page)]
+        content = "BT /F1 10 Tf 14 TL 50 760 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        stream = content.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects),))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{kid} 0 R" for kid in kids).encode(), pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(output))
+
+class Benchmark:
+    """Reproducible retrieval and ingestion measurements written to a JSON report.
+
+    Every corpus and PDF is generated from the seed, so two runs of the same
+    command on the same machine differ only by the code under test. Each
+    corpus gets its own database in the work directory, recreated empty on
+    every run (generated PDFs are kept and reused); the store settings
+    (index, storage, quantization, dtype) are the ones VectorStore takes.
+    Peak RSS is the process-wide maximum after each phase, so phases are
+    reported in the order they run (smallest corpus first).
+    """
+
+    def __init__(self, workdir: Path, seed: int = 0, dim: int = BENCHMARK_DIM, embeddings: str = "random",
+                 store_options: Optional[Dict] = None):
+        self.workdir = Path(workdir)
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self.seed = seed
+        self.dim = dim
+        self.embeddings = embeddings
+        self.store_options = store_options or {}
+        self.stub = StubEmbeddingGenerator(dim)
+
+    def _store(self, name: str) -> VectorStore:
+        """A fresh, empty store; a previous run's database (and its indexes/segments) is discarded"""
+        directory = self.workdir / name
+        if directory.exists():
+            shutil.rmtree(directory)
+        directory.mkdir()
+        return VectorStore(str(directory / "vector_store.db"), **self.store_options)
+
+    def search(self, size: int, queries: int = 200, top_k: int = 5, modes: Tuple[str, ...] = ("vector",),
+               nprobe: Optional[int] = None) -> Dict:
+        """Load a synthetic corpus of size chunks, then time top_k searches against it"""
+        rng = np.random.default_rng(self.seed)
+        text = SyntheticText(rng)
+        centers = rng.standard_normal((256, self.dim), dtype=np.float32)
+        embedder = self.stub if self.embeddings == "stub" else None
+        store = self._store(f"corpus-{size}")
+
+        print(f"Loading {size} chunks...")
+        started = time.perf_counter()
+        batch = []
+        for document in synthetic_documents(size, text, rng, centers, embedder):
+            batch.append(document)
+            if len(batch) == BENCHMARK_DOCUMENTS_PER_BATCH:
+                store.store_documents(batch, BENCHMARK_USER_ID, model_name=self.stub.model_name)
+                batch = []
+        if batch:
+            store.store_documents(batch, BENCHMARK_USER_ID, model_name=self.stub.model_name)
+        load_seconds = time.perf_counter() - started
+
+        # Queries resemble stored chunks: near a corpus vector, or with words from the same distribution
+        query_texts = [text.sentence(8) for _ in range(queries)]
+        query_embeddings = (self.stub.generate_embeddings(query_texts) if embedder is not None
+                            else clustered_embeddings(rng, centers, queries))
+
+        # The first search loads (or builds) the resident index; that cost is reported on its own
+        started = time.perf_counter()
+        store.search_similar(query_embeddings[0], top_k, BENCHMARK_USER_ID, nprobe, query_texts[0], modes[0])
+        first_search_seconds = time.perf_counter() - started
+
+        result = {
+            'chunks': size,
+            'load_seconds': load_seconds,
+            'load_chunks_per_second': size / load_seconds if load_seconds else 0.0,
+            'first_search_ms': first_search_seconds * 1000
+        }
+        for mode in modes:
+            samples = []
+            for query_text, query_embedding in zip(query_texts, query_embeddings):
+                started = time.perf_counter()
+                store.search_similar(query_embedding, top_k, BENCHMARK_USER_ID, nprobe, query_text, mode)
+                samples.append(time.perf_counter() - started)
+            result[mode] = latency_summary(samples)
+        result['peak_rss_mb'] = peak_rss_mb()
+        store.pool.close_all()
+        return result
+
+    def ingestion(self, documents: int = 20, pages: int = 50, embedder: str = "stub",
+                  extraction_workers: Optional[int] = None) -> Dict:
+        """Extract, chunk, embed and store generated PDFs; reports extraction and end-to-end throughput"""
+        from ingestion import embed_chunks
+        from pdf_processor import PDF_EXTRACTION_WORKERS, PDFProcessor
+
+        rng = np.random.default_rng(self.seed)
+        text = SyntheticText(rng)
+        pdf_dir = self.workdir / f"pdfs-{documents}x{pages}"
+        pdf_dir.mkdir(exist_ok=True)
+        paths = []
+        for document in range(documents):
+            path = pdf_dir / f"document-{document}.pdf"
+            if not path.exists():
+                write_synthetic_pdf(path, pages, text)
+            paths.append(path)
+
+        if embedder == "model":
+            from embeddings import EmbeddingGenerator
+            generator = EmbeddingGenerator()
+        else:
+            generator = self.stub
+        processor = PDFProcessor(extraction_workers=PDF_EXTRACTION_WORKERS if extraction_workers is None
+                                 else extraction_workers)
+        store = self._store(f"ingestion-{documents}x{pages}-{embedder}")
+
+        extract_seconds = embed_seconds = store_seconds = 0.0
+        chunk_count = 0
+        try:
+            for path in paths:
+                started = time.perf_counter()
+                chunks = processor.extract_and_chunk(str(path))
+                extract_seconds += time.perf_counter() - started
+
+                started = time.perf_counter()
+                embeddings, _ = embed_chunks(chunks, generator, store)
+                embed_seconds += time.perf_counter() - started
+
+                started = time.perf_counter()
+                store.store_document(file_hash_of(path), path.name, chunks, embeddings, BENCHMARK_USER_ID,
+                                     model_name=generator.model_name)
+                store_seconds += time.perf_counter() - started
+                chunk_count += len(chunks)
+        finally:
+            processor.close()
+            store.pool.close_all()
+
+        total_pages = documents * pages
+        total_seconds = extract_seconds + embed_seconds + store_seconds
+        return {
+            'documents': documents,
+            'pages': total_pages,
+            'chunks': chunk_count,
+            'embedder': generator.model_name,
+            'extract_seconds': extract_seconds,
+            'embed_seconds': embed_seconds,
+            'store_seconds': store_seconds,
+            'extract_pages_per_second': total_pages / extract_seconds if extract_seconds else 0.0,
+            'pages_per_second': total_pages / total_seconds if total_seconds else 0.0,
+            'chunks_per_second': chunk_count / total_seconds if total_seconds else 0.0,
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+def file_hash_of(path: Path) -> str:
+    return hashlib.md5(path.read_bytes()).hexdigest()
+
+def environment() -> Dict:
+    """What the numbers depend on besides the code: machine, interpreter and revision"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def flatten(report: Dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a report keyed by dotted path"""
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """One line per metric present in both reports, with the relative change and whether it is better"""
+    before = flatten(baseline.get("results", {}))
+    after = flatten(current.get("results", {}))
+    lines = []
+    for path in sorted(before.keys() & after.keys()):
+        old, new = before[path], after[path]
+        if not old or path.endswith((".chunks", ".pages", ".documents")):
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if path.endswith(HIGHER_IS_BETTER) else change < 0
+        marker = "" if abs(change) < 5 else (" (better)" if better else " (worse)")
+        lines.append(f"{path}: {old:.4g} -> {new:.4g} ({change:+.1f}%){marker}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval and ingestion on synthetic data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write a JSON report")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--workdir", default=None, help="Where corpora and PDFs are generated (default: a temp dir)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--sizes", default=",".join(str(size) for size in BENCHMARK_SIZES),
+                            help="Comma-separated corpus sizes in chunks; empty to skip the search benchmark")
+    run_parser.add_argument("--dim", type=int, default=BENCHMARK_DIM)
+    run_parser.add_argument("--embeddings", choices=("random", "stub"), default="random",
+                            help="Corpus vectors: clustered random vectors, or the stub embedder over the chunk text")
+    run_parser.add_argument("--queries", type=int, default=200)
+    run_parser.add_argument("--top-k", type=int, default=5)
+    run_parser.add_argument("--modes", default="vector", help="Comma-separated search modes (vector, hybrid)")
+    run_parser.add_argument("--nprobe", type=int, default=None)
+    run_parser.add_argument("--index", choices=("flat", "ivf"), default=None)
+    run_parser.add_argument("--storage", choices=("sqlite", "mmap"), default=None)
+    run_parser.add_argument("--quantization", default=None, help="none, int8 or pq")
+    run_parser.add_argument("--dtype", choices=("float32", "float16"), default=None, help="Embedding storage dtype")
+    run_parser.add_argument("--pdfs", type=int, default=20, help="Generated PDFs for the ingestion benchmark; 0 to skip")
+    run_parser.add_argument("--pages", type=int, default=50, help="Pages per generated PDF")
+    run_parser.add_argument("--embedder", choices=("stub", "model"), default="stub",
+                            help="Embedder for ingestion; 'model' loads the real embedding model")
+    run_parser.add_argument("--extraction-workers", type=int, default=None)
+    run_parser.add_argument("--compare", default=None, help="Earlier report to compare the new one against")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        print("\n".join(compare(baseline, current)))
+        sys.exit(0)
+
+    store_options = {name: value for name, value in (
+        ("index_type", args.index), ("storage", args.storage),
+        ("quantization", args.quantization), ("embedding_dtype", args.dtype)) if value is not None}
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="ragai-benchmark-"))
+    benchmark = Benchmark(workdir, args.seed, args.dim, args.embeddings, store_options)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    modes = tuple(mode.strip() for mode in args.modes.split(",") if mode.strip())
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key not in ("command", "output", "compare")},
+        'results': {'search': {}}
+    }
+    for size in sizes:
+        result = benchmark.search(size, args.queries, args.top_k, modes, args.nprobe)
+        report['results']['search'][str(size)] = result
+        print(f"{size} chunks: " + ", ".join(
+            f"{mode} p50 {result[mode]['p50_ms']:.2f}ms p99 {result[mode]['p99_ms']:.2f}ms" for mode in modes))
+    if args.pdfs:
+        result = benchmark.ingestion(args.pdfs, args.pages, args.embedder, args.extraction_workers)
+        report['results']['ingestion'] = result
+        print(f"Ingestion: {result['extract_pages_per_second']:.1f} pages/sec extracted, "
+              f"{result['pages_per_second']:.1f} pages/sec and {result['chunks_per_second']:.1f} chunks/sec end to end")
+    report['results']['peak_rss_mb'] = peak_rss_mb()
+    print(f"Peak RSS: {report['results']['peak_rss_mb']:.0f} MB")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), report)))
@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ingestion import embed_chunks
+from vector_store import VectorStore
+
+BULK_EXTRACTION_WORKERS = int(os.getenv("BULK_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+# Chunks from several documents are embedded and written together once this many are pending
+BULK_EMBEDDING_BATCH = int(os.getenv("BULK_EMBEDDING_BATCH", "1024"))
+
+# Statuses of files that need no more work; 'failed' files are retried by the next run
+FINISHED_STATUSES = ("stored", "shared", "skipped")
+
+# Per-process PDFProcessor used by the extraction workers
+_worker_processor = None
+
+def file_hash(path: Path) -> str:
+    """MD5 of the file contents; the same document hash the upload endpoints use"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_chunks(path: str) -> List[str]:
+    """Chunk one PDF; runs inside a pool worker, one file per task"""
+    global _worker_processor
+    if _worker_processor is None:
+        from pdf_processor import PDFProcessor
+        # Files are already spread across processes, so pages are extracted serially
+        _worker_processor = PDFProcessor(extraction_workers=0)
+    return _worker_processor.extract_and_chunk(path)
+
+def start_extraction_pool(workers: int = BULK_EXTRACTION_WORKERS) -> ProcessPoolExecutor:
+    """Start the extraction pool; call it before the embedding model is loaded (see PDFProcessor._start_pool)"""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    executor = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context)
+    executor.submit(int).result()
+    return executor
+
+class BulkIngester:
+    """Offline ingestion of a directory of PDFs straight into the vector store.
+
+    Files are hashed up front so documents already stored (for this user or
+    another) cost no extraction. The rest are chunked in a process pool, one
+    file per task. Their chunks are embedded in large cross-document batches
+    and written with one transaction per batch. Every file gets a checkpoint
+    row, so an interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, vector_store: VectorStore, embedding_generator, user_id: Optional[int] = None,
+                 workers: int = BULK_EXTRACTION_WORKERS, batch_size: int = BULK_EMBEDDING_BATCH):
+        self.vector_store = vector_store
+        self.embedding_generator = embedding_generator
+        self.user_id = user_id
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.pool = vector_store.pool
+        self.stats = {'files': 0, 'resumed': 0, 'stored': 0, 'shared': 0, 'skipped': 0, 'failed': 0,
+                      'chunks': 0, 'chunks_reused': 0}
+        self.init_database()
+
+    def init_database(self):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bulk_ingest_checkpoints (
+                    path TEXT NOT NULL,
+                    user_id INTEGER,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    document_hash TEXT,
+                    status TEXT NOT NULL,
+                    chunk_count INTEGER,
+                    error TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_checkpoint_path ON bulk_ingest_checkpoints (path, user_id)")
+
+    def _finished(self) -> Dict[str, Tuple[int, float]]:
+        """(size, mtime) of every file this user's earlier runs finished; files changed since are redone"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT path, size, mtime FROM bulk_ingest_checkpoints
+                WHERE user_id IS ? AND status IN ({','.join('?' * len(FINISHED_STATUSES))})
+            """, (self.user_id, *FINISHED_STATUSES)).fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def _checkpoint(self, entries: List[Tuple[Path, Optional[str], str, Optional[int], Optional[str]]]):
+        """Record (path, document_hash, status, chunk_count, error) for finished files in one transaction"""
+        rows = []
+        for path, document_hash, status, chunk_count, error in entries:
+            stat = path.stat()
+            rows.append((str(path), self.user_id, stat.st_size, stat.st_mtime, document_hash, status,
+                         chunk_count, error))
+            self.stats[status] += 1
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM bulk_ingest_checkpoints WHERE path = ? AND user_id IS ?",
+                             [(row[0], row[1]) for row in rows])
+            conn.executemany("""
+                INSERT INTO bulk_ingest_checkpoints (path, user_id, size, mtime, document_hash, status,
+                                                     chunk_count, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def _pending_files(self, root: Path) -> Iterator[Path]:
+        finished = self._finished()
+        for path in sorted(root.rglob("*.pdf")):
+            self.stats['files'] += 1
+            stat = path.stat()
+            if finished.get(str(path)) == (stat.st_size, stat.st_mtime):
+                self.stats['resumed'] += 1
+                continue
+            yield path
+
+    def run(self, root: Path, executor: Optional[ProcessPoolExecutor] = None) -> Dict:
+        """Ingest every PDF under root; returns counters plus files/sec and chunks/sec"""
+        started = time.monotonic()
+        own_executor = executor is None
+        if own_executor:
+            executor = start_extraction_pool(self.workers)
+
+        files = self._pending_files(Path(root))
+        in_flight = {}
+        pending: List[Tuple[Path, str, List[str]]] = []
+        pending_chunks = 0
+        # Files whose content another file in this run is already extracting, by document hash
+        duplicates: Dict[str, List[Path]] = {}
+        try:
+            while True:
+                while len(in_flight) < 2 * self.workers:
+                    path = next(files, None)
+                    if path is None:
+                        break
+                    document_hash = file_hash(path)
+                    if document_hash in duplicates:
+                        duplicates[document_hash].append(path)
+                    elif self.vector_store.document_exists(document_hash, self.user_id):
+                        self._checkpoint([(path, document_hash, 'skipped', None, None)])
+                    elif self.vector_store.document_status(document_hash, self.user_id) == 'ingesting':
+                        # An upload of this file is still in progress (or interrupted and resumed by its job);
+                        # marked failed so a later run checks again once the job has finished it
+                        self._checkpoint([(path, document_hash, 'failed', None,
+                                           "An upload of this file is still being ingested")])
+                    elif self.vector_store.share_document(document_hash, path.name, self.user_id):
+                        self._checkpoint([(path, document_hash, 'shared', None, None)])
+                    else:
+                        duplicates[document_hash] = []
+                        in_flight[executor.submit(extract_chunks, str(path))] = (path, document_hash)
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, document_hash = in_flight.pop(future)
+                    try:
+                        chunks = future.result()
+                    except Exception as e:
+                        print(f"Error extracting {path}: {e}")
+                        self._fail([(path, document_hash, [])], duplicates, e)
+                        continue
+                    pending.append((path, document_hash, chunks))
+                    pending_chunks += len(chunks)
+
+                if pending_chunks >= self.batch_size:
+                    self._store_batch(pending, duplicates)
+                    pending, pending_chunks = [], 0
+                    self._report_progress(started)
+
+            if pending:
+                self._store_batch(pending, duplicates)
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures=True)
+
+        elapsed = time.monotonic() - started
+        ingested = self.stats['stored'] + self.stats['shared']
+        self.stats['seconds'] = elapsed
+        self.stats['files_per_second'] = ingested / elapsed if elapsed else 0.0
+        self.stats['chunks_per_second'] = self.stats['chunks'] / elapsed if elapsed else 0.0
+        return self.stats
+
+    def _store_batch(self, batch: List[Tuple[Path, str, List[str]]], duplicates: Dict[str, List[Path]]):
+        """Embed the chunks of several documents together and store them in one transaction.
+
+        If the batch cannot be stored, each document is retried on its own so
+        only the ones that still fail are checkpointed as 'failed'.
+        """
+        all_chunks = [chunk for _, _, chunks in batch for chunk in chunks]
+        try:
+            embeddings, reused = (embed_chunks(all_chunks, self.embedding_generator, self.vector_store)
+                                  if all_chunks else ([], 0))
+        except Exception as e:
+            print(f"Error embedding a batch of {len(batch)} files: {e}")
+            self._fail(batch, duplicates, e)
+            return
+
+        documents = []
+        offset = 0
+        for path, document_hash, chunks in batch:
+            documents.append((document_hash, path.name, chunks, embeddings[offset:offset + len(chunks)]))
+            offset += len(chunks)
+        try:
+            self.vector_store.store_documents(documents, self.user_id,
+                                              model_name=self.embedding_generator.model_name)
+            stored = batch
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Error storing {batch[0][0]}: {e}")
+                self._fail(batch, duplicates, e)
+                return
+            stored = []
+            for item, document in zip(batch, documents):
+                try:
+                    self.vector_store.store_documents([document], self.user_id,
+                                                      model_name=self.embedding_generator.model_name)
+                    stored.append(item)
+                except Exception as e:
+                    print(f"Error storing {item[0]}: {e}")
+                    self._fail([item], duplicates, e)
+
+        self.stats['chunks'] += sum(len(chunks) for _, _, chunks in stored)
+        self.stats['chunks_reused'] += reused
+        entries = []
+        for path, document_hash, chunks in stored:
+            entries.append((path, document_hash, 'stored', len(chunks), None))
+            entries.extend((duplicate, document_hash, 'skipped', None, None)
+                           for duplicate in duplicates.pop(document_hash))
+        self._checkpoint(entries)
+
+    def _fail(self, batch: List[Tuple[Path, str, List[str]]], duplicates: Dict[str, List[Path]], error: Exception):
+        """Checkpoint the batch's files (and their duplicates) as 'failed', to be retried by the next run"""
+        self._checkpoint([(p, document_hash, 'failed', None, str(error))
+                          for path, document_hash, _ in batch
+                          for p in [path] + duplicates.pop(document_hash)])
+
+    def _report_progress(self, started: float):
+        elapsed = time.monotonic() - started
+        print(f"{self.stats['stored'] + self.stats['shared']} files ingested, "
+              f"{self.stats['chunks']} chunks ({self.stats['chunks'] / elapsed:.1f} chunks/sec)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory of PDFs into the vector store")
+    parser.add_argument("directory", help="Directory searched recursively for .pdf files")
+    parser.add_argument("--db", default="vector_store.db")
+    parser.add_argument("--user-id", type=int, default=None, help="Owner of the ingested documents")
+    parser.add_argument("--workers", type=int, default=BULK_EXTRACTION_WORKERS, help="Extraction processes")
+    parser.add_argument("--batch-size", type=int, default=BULK_EMBEDDING_BATCH,
+                        help="Chunks embedded and written per batch")
+    args = parser.parse_args()
+
+    # Fork the extraction workers before the embedding model (and its threads) exist
+    extraction_pool = start_extraction_pool(args.workers)
+    from embeddings import EmbeddingGenerator
+
+    ingester = BulkIngester(VectorStore(args.db), EmbeddingGenerator(), args.user_id,
+                            args.workers, args.batch_size)
+    try:
+        stats = ingester.run(Path(args.directory), extraction_pool)
+    finally:
+        extraction_pool.shutdown(cancel_futures=True)
+
+    print(f"{stats['files']} files: {stats['stored']} stored, {stats['shared']} shared, "
+          f"{stats['skipped']} already stored, {stats['resumed']} done by an earlier run, {stats['failed']} failed")
+    print(f"{stats['chunks']} chunks ({stats['chunks_reused']} embeddings reused) in {stats['seconds']:.1f}s")
+    print(f"{stats['files_per_second']:.2f} files/sec, {stats['chunks_per_second']:.1f} chunks/sec")
@@ -0,0 +1,283 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# Seconds before a cached query embedding expires; 0 keeps entries until evicted
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "0"))
+
+# Generated answers, keyed on the asker's corpus version so document changes invalidate them
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "0"))
+# Answers longer than this are not cached, bounding the memory one entry can take
+ANSWER_CACHE_MAX_CHARS = int(os.getenv("ANSWER_CACHE_MAX_CHARS", "20000"))
+
+# Verified tokens and user profiles. Invalidation is explicit within a process; the
+# TTL bounds how long another worker process may keep serving a revoked token.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+# Paraphrased questions: answers are reused when the question embeddings' cosine
+# similarity reaches the threshold
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "0"))
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a question for cache keys: NFKC with whitespace collapsed.
+
+    Case is preserved because the embedding model is case-sensitive.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+class LRUCache:
+    """Thread-safe bounded mapping with least-recently-used eviction and an optional TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds or None
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry (explicit invalidation) and return its value"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class SemanticCache:
+    """Values looked up by embedding similarity within a scope, with LRU eviction and an optional TTL.
+
+    Every entry's normalized embedding lives in one preallocated matrix, so a
+    lookup is a single matrix-vector product masked to the caller's scope
+    (e.g. one user's corpus version). When the matrix is full the least
+    recently used entry is overwritten.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, ttl_seconds: Optional[float] = None):
+        self.max_entries = max(1, max_entries)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds or None
+        self._matrix: Optional[np.ndarray] = None  # allocated on the first put, once the dimension is known
+        self._slot_scopes = np.full(self.max_entries, -1, dtype=np.int64)
+        self._last_used = np.zeros(self.max_entries, dtype=np.int64)
+        self._expires_at = np.full(self.max_entries, np.inf)
+        self._values: List[Any] = [None] * self.max_entries
+        self._filled = 0
+        self._free: List[int] = []
+        self._scope_ids: Dict[Hashable, int] = {}
+        self._scope_sizes: Dict[int, int] = {}
+        self._scope_keys: Dict[int, Hashable] = {}
+        self._next_scope_id = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return self._filled - len(self._free)
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _best_match(self, scope_id: int, vector: np.ndarray) -> Tuple[int, float]:
+        """(slot, similarity) of the closest live entry in the scope, or (-1, -inf); drops expired entries"""
+        live = self._slot_scopes[:self._filled] == scope_id
+        if self.ttl_seconds:
+            expired = np.flatnonzero(live & (self._expires_at[:self._filled] <= time.monotonic()))
+            for slot in expired:
+                self._release(int(slot))
+                self.expirations += 1
+            live[expired] = False
+        if not live.any():
+            return -1, float("-inf")
+        scores = np.where(live, self._matrix[:self._filled] @ vector, -np.inf)
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def get(self, scope: Hashable, embedding: np.ndarray, default: Any = None) -> Any:
+        vector = self._normalize(embedding)
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is not None and vector is not None and vector.shape[0] == self._matrix.shape[1]:
+                slot, similarity = self._best_match(scope_id, vector)
+                if similarity >= self.threshold:
+                    self._clock += 1
+                    self._last_used[slot] = self._clock
+                    self.hits += 1
+                    return self._values[slot]
+            self.misses += 1
+            return default
+
+    def put(self, scope: Hashable, embedding: np.ndarray, value: Any):
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            elif vector.shape[0] != self._matrix.shape[1]:
+                raise ValueError(f"Embedding has {vector.shape[0]} values, expected {self._matrix.shape[1]}")
+
+            scope_id = self._scope_ids.get(scope)
+            slot = -1
+            if scope_id is not None:
+                # A near-identical question already has an entry: refresh it instead of adding a duplicate
+                slot, similarity = self._best_match(scope_id, vector)
+                if similarity < self.threshold:
+                    slot = -1
+            if slot < 0:
+                slot = self._allocate()
+                scope_id = self._scope_ids.get(scope)
+                if scope_id is None:
+                    scope_id = self._scope_ids[scope] = self._next_scope_id
+                    self._scope_keys[scope_id] = scope
+                    self._next_scope_id += 1
+                self._slot_scopes[slot] = scope_id
+                self._scope_sizes[scope_id] = self._scope_sizes.get(scope_id, 0) + 1
+
+            self._clock += 1
+            self._matrix[slot] = vector
+            self._values[slot] = value
+            self._last_used[slot] = self._clock
+            self._expires_at[slot] = time.monotonic() + self.ttl_seconds if self.ttl_seconds else np.inf
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._filled < self.max_entries:
+            self._filled += 1
+            return self._filled - 1
+        slot = int(np.argmin(self._last_used))
+        self._release(slot)
+        self.evictions += 1
+        return self._free.pop()
+
+    def _release(self, slot: int):
+        scope_id = int(self._slot_scopes[slot])
+        self._scope_sizes[scope_id] -= 1
+        if not self._scope_sizes[scope_id]:
+            # Scopes are typically (user, corpus version): forget ones that no longer hold entries
+            del self._scope_sizes[scope_id]
+            del self._scope_ids[self._scope_keys.pop(scope_id)]
+        self._slot_scopes[slot] = -1
+        self._values[slot] = None
+        self._last_used[slot] = 0
+        self._free.append(slot)
+
+    def clear(self):
+        with self._lock:
+            self._slot_scopes[:] = -1
+            self._last_used[:] = 0
+            self._values = [None] * self.max_entries
+            self._filled = 0
+            self._free = []
+            self._scope_ids.clear()
+            self._scope_sizes.clear()
+            self._scope_keys.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'threshold': self.threshold,
+                'scopes': len(self._scope_sizes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class BloomFilter:
+    """Approximate set: membership tests have no false negatives and about error_rate false positives.
+
+    Sized for ``capacity`` keys; past that the false-positive rate climbs, so
+    owners should rebuild a larger filter once ``count`` exceeds it.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+# Seconds a connection waits on a locked database before raising "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+# NORMAL is durable in WAL mode except for the last transactions before a power loss
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Prepared statements kept per connection; every query in the app uses a fixed SQL string
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+class _PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection that can be weakly referenced by its pool and knows when it was closed"""
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+class ConnectionPool:
+    """Persistent per-thread SQLite connections to one database file in WAL mode.
+
+    Each thread reuses its own connections (and their prepared statement
+    caches) instead of opening one per call. WAL lets readers proceed while a
+    writer holds the lock, so searches and auth checks no longer queue behind
+    ingestion. A nested ``connection()`` on the same thread gets a separate
+    connection, so each block keeps its own transaction as with ``sqlite3.connect``.
+    """
+
+    def __init__(self, db_path: str, foreign_keys: bool = False, busy_timeout: float = SQLITE_BUSY_TIMEOUT,
+                 synchronous: str = SQLITE_SYNCHRONOUS, cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+                 mmap_size: int = SQLITE_MMAP_SIZE, cached_statements: int = SQLITE_CACHED_STATEMENTS):
+        self.db_path = str(db_path)
+        self.foreign_keys = foreign_keys
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        # Every open connection, so shutdown can close those of other threads too
+        self._connections = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
+
+        # The journal mode is stored in the database file, so this only has to succeed once
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, factory=_PooledConnection,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA foreign_keys={'ON' if self.foreign_keys else 'OFF'}")
+        with self._connections_lock:
+            self._connections.add(conn)
+        return conn
+
+    def _idle(self) -> List[sqlite3.Connection]:
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    @contextmanager
+    def connection(self, row_factory: Optional[Callable] = None) -> Iterator[sqlite3.Connection]:
+        """Borrow this thread's connection; commits on success and rolls back on error like ``with sqlite3.connect(...)``"""
+        idle = self._idle()
+        while idle and idle[-1].closed:
+            idle.pop()
+        conn = idle.pop() if idle else self._connect()
+        conn.row_factory = row_factory
+        try:
+            with conn:
+                yield conn
+        finally:
+            # Never hand out a connection still inside a transaction (e.g. an explicit BEGIN left open)
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            idle.append(conn)
+
+    def close_all(self):
+        """Close every pooled connection; threads open fresh ones if they query again"""
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections = weakref.WeakSet()
+        for conn in connections:
+            conn.close()
@@ -1,7 +1,16 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from typing import List
+import asyncio
+import os
 import torch
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import EMBEDDING_BATCH_SIZE, timed
+
+# Query embedding micro-batching: wait this long for more queries to share a forward pass
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
 
 class EmbeddingGenerator:
     def __init__(self, model_name: str = "BAAI/bge-m3"):
@@ -17,12 +26,14 @@ class EmbeddingGenerator:
         """Generate embeddings for a list of texts"""
         try:
             # Generate embeddings
-            embeddings = self.model.encode(
-                texts,
-                convert_to_numpy=True,
-                show_progress_bar=True,
-                batch_size=32
-            )
+            EMBEDDING_BATCH_SIZE.observe(len(texts))
+            with timed("embed"):
+                embeddings = self.model.encode(
+                    texts,
+                    convert_to_numpy=True,
+                    show_progress_bar=True,
+                    batch_size=32
+                )
             
             return embeddings
             
@@ -35,4 +46,79 @@ class EmbeddingGenerator:
     
     def get_embedding_dimension(self) -> int:
         """Get the dimension of embeddings produced by the model"""
-        return self.model.get_sentence_embedding_dimension()
\ No newline at end of file
+        return self.model.get_sentence_embedding_dimension()
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batched encode calls.
+
+    The first queued text opens a window of max_wait_ms (or until
+    max_batch_size texts have arrived); everything collected is encoded in one
+    forward pass on a dedicated thread and each caller gets its own row back.
+    While a batch is encoding, new requests queue up for the next one.
+    """
+
+    def __init__(self, generator: EmbeddingGenerator, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms: float = EMBEDDING_BATCH_WINDOW_MS):
+        self.generator = generator
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        # One thread: batches run back to back instead of competing for the same cores
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embedder")
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed one text, sharing a model call with any concurrent requests"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (e.g. disconnected clients) don't need encoding
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor, self.generator.generate_embeddings, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=False)
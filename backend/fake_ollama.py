@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_OLLAMA_PORT = int(os.getenv("FAKE_OLLAMA_PORT", "11434"))
+FAKE_OLLAMA_MODELS = os.getenv("FAKE_OLLAMA_MODELS", "qwen3:0.6b")
+# Latency model: a fixed delay before the first token, then tokens at a steady rate
+FAKE_OLLAMA_TTFT_MS = float(os.getenv("FAKE_OLLAMA_TTFT_MS", "200"))
+FAKE_OLLAMA_TOKENS_PER_SECOND = float(os.getenv("FAKE_OLLAMA_TOKENS_PER_SECOND", "40"))
+FAKE_OLLAMA_RESPONSE_TOKENS = int(os.getenv("FAKE_OLLAMA_RESPONSE_TOKENS", "120"))
+# Fraction of generations refused outright with ERROR_STATUS, and of streams cut off midway
+FAKE_OLLAMA_ERROR_RATE = float(os.getenv("FAKE_OLLAMA_ERROR_RATE", "0"))
+FAKE_OLLAMA_ERROR_STATUS = int(os.getenv("FAKE_OLLAMA_ERROR_STATUS", "503"))
+FAKE_OLLAMA_DISCONNECT_RATE = float(os.getenv("FAKE_OLLAMA_DISCONNECT_RATE", "0"))
+
+WORDS = ("the", "document", "describes", "a", "method", "for", "retrieval", "of", "relevant", "context",
+         "based", "on", "similarity", "between", "query", "and", "chunk", "embeddings", "which", "is",
+         "then", "passed", "to", "model", "answer", "question", "using", "sources", "provided", "above")
+
+class FakeOllamaConfig:
+    """Behaviour of the stand-in server; every field can be set from the command line or the environment"""
+
+    def __init__(self, models: List[str] = None, ttft_ms: float = FAKE_OLLAMA_TTFT_MS,
+                 tokens_per_second: float = FAKE_OLLAMA_TOKENS_PER_SECOND,
+                 response_tokens: int = FAKE_OLLAMA_RESPONSE_TOKENS, error_rate: float = FAKE_OLLAMA_ERROR_RATE,
+                 error_status: int = FAKE_OLLAMA_ERROR_STATUS, disconnect_rate: float = FAKE_OLLAMA_DISCONNECT_RATE,
+                 seed: Optional[int] = None):
+        self.models = models or [model.strip() for model in FAKE_OLLAMA_MODELS.split(",") if model.strip()]
+        self.ttft = ttft_ms / 1000
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.response_tokens = max(1, response_tokens)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+
+def answer_tokens(prompt: str, count: int) -> List[str]:
+    """Deterministic filler answer for a prompt, split the way Ollama streams it (leading spaces)"""
+    rng = random.Random(hashlib.md5(prompt.encode("utf-8")).digest())
+    return [("" if i == 0 else " ") + rng.choice(WORDS) for i in range(count)]
+
+def create_app(config: Optional[FakeOllamaConfig] = None) -> FastAPI:
+    """Stand-in for the parts of the Ollama HTTP API the backend uses: /api/generate and /api/tags.
+
+    Answers are filler text, but the timing is configurable: time to first
+    token, token rate and answer length, plus injected failures (error
+    statuses before any output, and streams cut off midway). This allows load
+    testing the query endpoints without a GPU or a downloaded model.
+    """
+    config = config or FakeOllamaConfig()
+    app = FastAPI(title="Fake Ollama")
+    app.state.config = config
+    app.state.stats = {'requests': 0, 'errors': 0, 'disconnects': 0, 'in_flight': 0}
+
+    def final_chunk(model: str, tokens: int, started: float, eval_started: float) -> Dict:
+        now = time.perf_counter()
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": "",
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((now - started) * 1e9),
+            "prompt_eval_duration": int((eval_started - started) * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int((now - eval_started) * 1e9)
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model, "model": model, "size": 0, "details": {"family": "fake"}}
+                           for model in config.models]}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "")
+        prompt = payload.get("prompt", "")
+        stats = app.state.stats
+        stats['requests'] += 1
+
+        if model not in config.models:
+            return JSONResponse({"error": f"model '{model}' not found"}, status_code=404)
+        if config.random.random() < config.error_rate:
+            stats['errors'] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=config.error_status)
+
+        tokens = answer_tokens(prompt, config.response_tokens)
+        started = time.perf_counter()
+
+        if not payload.get("stream", True):
+            stats['in_flight'] += 1
+            try:
+                await asyncio.sleep(config.ttft + config.token_interval * (len(tokens) - 1))
+            finally:
+                stats['in_flight'] -= 1
+            eval_started = started + config.ttft
+            result = final_chunk(model, len(tokens), started, eval_started)
+            result["response"] = "".join(tokens)
+            return result
+
+        # Decided up front so the outcome doesn't depend on scheduling
+        cut_after = (config.random.randrange(len(tokens))
+                     if config.random.random() < config.disconnect_rate else None)
+
+        async def stream():
+            stats['in_flight'] += 1
+            try:
+                await asyncio.sleep(config.ttft)
+                eval_started = time.perf_counter()
+                for i, token in enumerate(tokens):
+                    if i == cut_after:
+                        stats['disconnects'] += 1
+                        # Aborts the response mid-body, as a crashed or killed server would
+                        raise ConnectionAbortedError("injected disconnect")
+                    if i:
+                        await asyncio.sleep(config.token_interval)
+                    yield json.dumps({"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                                      "response": token, "done": False}) + "\n"
+                yield json.dumps(final_chunk(model, len(tokens), started, eval_started)) + "\n"
+            finally:
+                stats['in_flight'] -= 1
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a stand-in Ollama API with configurable latency and failures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=FAKE_OLLAMA_PORT)
+    parser.add_argument("--models", default=FAKE_OLLAMA_MODELS, help="Comma-separated model names to advertise")
+    parser.add_argument("--ttft-ms", type=float, default=FAKE_OLLAMA_TTFT_MS, help="Delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=FAKE_OLLAMA_TOKENS_PER_SECOND)
+    parser.add_argument("--response-tokens", type=int, default=FAKE_OLLAMA_RESPONSE_TOKENS)
+    parser.add_argument("--error-rate", type=float, default=FAKE_OLLAMA_ERROR_RATE,
+                        help="Fraction of generations answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=FAKE_OLLAMA_ERROR_STATUS)
+    parser.add_argument("--disconnect-rate", type=float, default=FAKE_OLLAMA_DISCONNECT_RATE,
+                        help="Fraction of streams cut off after a random number of tokens")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig([model.strip() for model in args.models.split(",") if model.strip()], args.ttft_ms,
+                              args.tokens_per_second, args.response_tokens, args.error_rate, args.error_status,
+                              args.disconnect_rate, args.seed)
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,276 @@
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from db import ConnectionPool
+from vector_store import chunk_content_hash
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "5"))
+# A running job whose heartbeat is older than this is assumed to belong to a dead worker
+INGESTION_STALE_SECONDS = int(os.getenv("INGESTION_STALE_SECONDS", "300"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+# Chunks embedded and stored per batch; bounds ingestion memory regardless of document size
+INGESTION_EMBEDDING_BATCH = int(os.getenv("INGESTION_EMBEDDING_BATCH", "64"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+def embed_chunks(chunks: List[str], embedding_generator, vector_store) -> Tuple[np.ndarray, int]:
+    """Embed chunks, reusing stored embeddings of identical text from the same model.
+
+    Only chunks never seen before reach the model (each distinct text once).
+    Returns the embeddings and how many chunks were served from the store.
+    """
+    model_name = embedding_generator.model_name
+    hashes = [chunk_content_hash(chunk, model_name) for chunk in chunks]
+    known = vector_store.find_embeddings(chunks, model_name)
+
+    missing = {}
+    for chunk, content_hash in zip(chunks, hashes):
+        if content_hash not in known:
+            missing.setdefault(content_hash, chunk)
+    if missing:
+        fresh = embedding_generator.generate_embeddings(list(missing.values()))
+        known.update(zip(missing.keys(), fresh))
+
+    embeddings = np.stack([np.asarray(known[content_hash], dtype=np.float32) for content_hash in hashes])
+    reused = sum(1 for content_hash in hashes if content_hash not in missing)
+    return embeddings, reused
+
+class IngestionQueue:
+    """SQLite-backed queue that turns uploaded PDFs into stored embeddings off the request path.
+
+    The upload endpoint only saves the file and enqueues a job; a bounded pool
+    of worker threads streams pages -> chunks -> embedding batches -> store and
+    records its progress on the job row. Jobs live in the vector store database, so queued
+    work and jobs interrupted by a restart are picked up again on startup.
+    """
+
+    def __init__(self, db_path: str, upload_dir: Path, pdf_processor, embedding_generator, vector_store,
+                 workers: int = INGESTION_WORKERS):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        self.upload_dir = Path(upload_dir)
+        self.pdf_processor = pdf_processor
+        self.embedding_generator = embedding_generator
+        self.vector_store = vector_store
+        self.workers = max(1, workers)
+        self._wakeup = threading.Event()
+        self._threads = []
+        self.upload_dir.mkdir(exist_ok=True)
+        self.init_database()
+
+    def init_database(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    document_hash TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT NOT NULL DEFAULT 'queued',
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    total_pages INTEGER,
+                    chunks_total INTEGER,
+                    chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                    chunks_reused INTEGER NOT NULL DEFAULT 0,
+                    document_id TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("PRAGMA table_info(ingestion_jobs)")
+            if "chunks_reused" not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN chunks_reused INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_status ON ingestion_jobs (status, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_user_hash ON ingestion_jobs (user_id, document_hash)")
+            conn.commit()
+
+    def enqueue(self, user_id: Optional[int], filename: str, content: bytes, document_hash: str) -> Dict:
+        """Persist an upload and queue it, reusing the user's active job for the same file"""
+        with self.pool.connection(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT * FROM ingestion_jobs
+                WHERE user_id IS ? AND document_hash = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+            """, (user_id, document_hash, *ACTIVE_STATUSES))
+            existing = cursor.fetchone()
+            if existing:
+                return self._to_dict(existing)
+
+            job_id = str(uuid.uuid4())
+            file_path = self.upload_dir / f"{job_id}.pdf"
+            with open(file_path, "wb") as f:
+                f.write(content)
+
+            cursor.execute("""
+                INSERT INTO ingestion_jobs (id, user_id, filename, file_path, document_hash)
+                VALUES (?, ?, ?, ?, ?)
+            """, (job_id, user_id, filename, str(file_path), document_hash))
+            conn.commit()
+            cursor.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,))
+            job = self._to_dict(cursor.fetchone())
+
+        self._wakeup.set()
+        return job
+
+    def get_job(self, job_id: str, user_id: Optional[int] = None) -> Optional[Dict]:
+        """Fetch a job, scoped to its owner when user_id is given"""
+        with self.pool.connection(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            if user_id is not None:
+                cursor.execute("SELECT * FROM ingestion_jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+            else:
+                cursor.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._to_dict(row) if row else None
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job.pop("file_path", None)
+        return job
+
+    def _update(self, job_id: str, **fields):
+        """Write progress fields and bump the heartbeat"""
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.pool.connection() as conn:
+            conn.execute(f"""
+                UPDATE ingestion_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+            """, (*fields.values(), job_id))
+            conn.commit()
+
+    def _claim(self) -> Optional[Dict]:
+        """Atomically take the oldest runnable job, reclaiming jobs abandoned by dead workers"""
+        with self.pool.connection(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                UPDATE ingestion_jobs SET status = 'queued'
+                WHERE status = 'running' AND updated_at < datetime('now', ?)
+            """, (f"-{INGESTION_STALE_SECONDS} seconds",))
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET status = 'failed', stage = 'failed', updated_at = CURRENT_TIMESTAMP,
+                    error = COALESCE(error, 'Gave up after repeated interrupted attempts')
+                WHERE status = 'queued' AND attempts >= ?
+            """, (INGESTION_MAX_ATTEMPTS,))
+            # Identical files wait for the running one so the content is processed once and shared
+            cursor.execute("""
+                SELECT * FROM ingestion_jobs
+                WHERE status = 'queued'
+                  AND document_hash NOT IN (SELECT document_hash FROM ingestion_jobs WHERE status = 'running')
+                ORDER BY created_at, rowid LIMIT 1
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("COMMIT")
+                return None
+
+            cursor.execute("""
+                UPDATE ingestion_jobs
+                SET status = 'running', stage = 'processing', attempts = attempts + 1,
+                    pages_done = 0, chunks_embedded = 0, chunks_reused = 0, error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (row["id"],))
+            cursor.execute("COMMIT")
+            return dict(row)
+
+    def _run(self, job: Dict):
+        """Stream the PDF through chunking and embedding, storing each batch as soon as it is embedded"""
+        job_id = job["id"]
+
+        # The same file may have finished under another job (or a previous attempt) meanwhile,
+        # possibly for another user, in which case the stored content is simply shared
+        if (self.vector_store.document_exists(job["document_hash"], job["user_id"]) or
+                self.vector_store.share_document(job["document_hash"], job["filename"], job["user_id"])):
+            self._finish(job)
+            return
+
+        document_id, stored = self.vector_store.create_document(job["document_hash"], job["filename"],
+                                                                job["user_id"])
+        self._update(job_id, stage="processing", document_id=document_id, chunks_embedded=stored)
+        job["chunks_reused"] = 0
+
+        def on_page(pages_done: int, total_pages: int):
+            self._update(job_id, pages_done=pages_done, total_pages=total_pages)
+
+        batch = []
+        chunk_count = 0
+        for chunk in self.pdf_processor.iter_chunks(job["file_path"], on_page):
+            # Chunking is deterministic, so chunks kept by an interrupted attempt are skipped, not redone
+            if chunk_count >= stored:
+                batch.append(chunk)
+            chunk_count += 1
+            if len(batch) == INGESTION_EMBEDDING_BATCH:
+                self._store_batch(job, document_id, batch, chunk_count - len(batch))
+                batch = []
+        if batch:
+            self._store_batch(job, document_id, batch, chunk_count - len(batch))
+
+        self.vector_store.finalize_document(document_id)
+        self._update(job_id, chunks_total=chunk_count)
+        self._finish(job)
+
+    def _store_batch(self, job: Dict, document_id: str, chunks: List[str], start_index: int):
+        embeddings, reused = embed_chunks(chunks, self.embedding_generator, self.vector_store)
+        self.vector_store.append_chunks(document_id, chunks, embeddings, start_index, job["user_id"],
+                                        model_name=self.embedding_generator.model_name)
+        job["chunks_reused"] += reused
+        self._update(job["id"], chunks_embedded=start_index + len(chunks), chunks_reused=job["chunks_reused"])
+
+    def _finish(self, job: Dict):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM documents WHERE document_hash = ? AND user_id IS ?",
+                           (job["document_hash"], job["user_id"]))
+            row = cursor.fetchone()
+        self._update(job["id"], status="completed", stage="completed", document_id=row[0] if row else None)
+        self._remove_upload(job["file_path"])
+
+    @staticmethod
+    def _remove_upload(file_path: str):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming ingestion job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(INGESTION_POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._run(job)
+                logger.info(f"Ingested {job['filename']} (job {job['id']})")
+            except Exception as e:
+                logger.error(f"Error ingesting {job['filename']} (job {job['id']}): {e}")
+                self._update(job["id"], status="failed", stage="failed", error=str(e))
+                self._remove_upload(job["file_path"])
+
+    def start(self):
+        """Start the worker threads; queued and interrupted jobs are resumed from the table"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
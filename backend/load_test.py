@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmark import SyntheticText, write_synthetic_pdf
+
+# Signup runs email deliverability checks, so synthetic users need a domain with MX records
+LOAD_TEST_EMAIL_DOMAIN = "gmail.com"
+LOAD_TEST_PASSWORD = "LoadTest#2024"
+# Longest wait for an uploaded document to finish ingestion
+LOAD_TEST_INGESTION_TIMEOUT = 600
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """Percentiles of request latencies, in milliseconds"""
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max())
+    }
+
+class LoadGenerator:
+    """Drives the API end to end: synthetic users sign up, upload generated PDFs, then query concurrently.
+
+    Query traffic is closed-loop: ``concurrency`` workers each send their next
+    request as soon as the previous one finishes, so throughput rises until
+    some stage saturates and the latency percentiles show where that happens.
+    A run against the stand-in server (fake_ollama.py) needs no GPU or model.
+    Rate limits apply to these users like any other, so for capacity tests
+    start the API with RATE_LIMIT_ENABLED=false.
+    """
+
+    def __init__(self, base_url: str, users: int = 10, documents_per_user: int = 1, pages: int = 5,
+                 concurrency: int = 16, stream_ratio: float = 0.5, model: Optional[str] = None,
+                 use_cache: bool = False, seed: int = 0, email_domain: str = LOAD_TEST_EMAIL_DOMAIN):
+        self.base_url = base_url.rstrip("/")
+        self.users = users
+        self.documents_per_user = documents_per_user
+        self.pages = pages
+        self.concurrency = concurrency
+        self.stream_ratio = stream_ratio
+        self.model = model
+        self.use_cache = use_cache
+        self.email_domain = email_domain
+        self.random = random.Random(seed)
+        self.text = SyntheticText(np.random.default_rng(seed))
+        self.tokens: List[str] = []
+        # endpoint -> latencies (seconds) of successful requests, status counts, stream time to first token
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.first_token = []
+
+    async def _send(self, client: httpx.AsyncClient, endpoint: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """One request, recorded under endpoint; a 429 is waited out (Retry-After) and retried"""
+        while True:
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            self.statuses[endpoint][response.status_code] += 1
+            if response.status_code != 429:
+                if response.is_success:
+                    self.latencies[endpoint].append(time.perf_counter() - started)
+                return response
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+    async def setup_users(self, client: httpx.AsyncClient):
+        run_id = secrets.token_hex(4)
+        for i in range(self.users):
+            response = await self._send(client, "signup", "POST", "/signup", json={
+                "email": f"loadtest.{run_id}.{i}@{self.email_domain}",
+                "password": LOAD_TEST_PASSWORD,
+                "confirm_password": LOAD_TEST_PASSWORD,
+                "full_name": "Load Test User"
+            })
+            if not response.is_success:
+                raise RuntimeError(f"Signup failed ({response.status_code}): {response.text}")
+            self.tokens.append(response.json()["access_token"])
+        print(f"Signed up {len(self.tokens)} users")
+
+    async def upload_documents(self, client: httpx.AsyncClient, pdf_dir: Path):
+        """Upload distinct generated PDFs for every user and wait until all are ingested"""
+        jobs = []
+        for user, token in enumerate(self.tokens):
+            for document in range(self.documents_per_user):
+                path = pdf_dir / f"user-{user}-document-{document}.pdf"
+                write_synthetic_pdf(path, self.pages, self.text)
+                with open(path, "rb") as f:
+                    response = await self._send(client, "upload", "POST", "/upload-pdf/",
+                                                headers={"Authorization": f"Bearer {token}"},
+                                                files={"file": (path.name, f.read(), "application/pdf")})
+                if not response.is_success:
+                    raise RuntimeError(f"Upload failed ({response.status_code}): {response.text}")
+                job_id = response.json().get("job_id")
+                if job_id:
+                    jobs.append((token, job_id))
+
+        started = time.perf_counter()
+        deadline = started + LOAD_TEST_INGESTION_TIMEOUT
+        pending = list(jobs)
+        while pending:
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"{len(pending)} uploads still not ingested after {LOAD_TEST_INGESTION_TIMEOUT}s")
+            await asyncio.sleep(0.5)
+            still_pending = []
+            for token, job_id in pending:
+                response = await client.get(f"/jobs/{job_id}", headers={"Authorization": f"Bearer {token}"})
+                job = response.json()
+                if job.get("status") == "failed":
+                    raise RuntimeError(f"Ingestion of job {job_id} failed: {job.get('error')}")
+                if job.get("status") != "completed":
+                    still_pending.append((token, job_id))
+            pending = still_pending
+        elapsed = time.perf_counter() - started
+        print(f"Uploaded and ingested {self.users * self.documents_per_user} documents "
+              f"({self.users * self.documents_per_user * self.pages} pages) in {elapsed:.1f}s")
+
+    async def _query(self, client: httpx.AsyncClient):
+        token = self.random.choice(self.tokens)
+        body = {"question": self.text.sentence(8), "no_cache": not self.use_cache}
+        if self.model:
+            body["model"] = self.model
+        headers = {"Authorization": f"Bearer {token}"}
+
+        if self.random.random() >= self.stream_ratio:
+            await self._send(client, "query", "POST", "/query/", json=body, headers=headers)
+            return
+
+        started = time.perf_counter()
+        async with client.stream("POST", "/query/stream/", json=body, headers=headers) as response:
+            self.statuses["query_stream"][response.status_code] += 1
+            if not response.is_success:
+                await response.aread()
+                if response.status_code == 429:
+                    await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+                return
+            first_token_at = None
+            failed = False
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "token" and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                elif event["type"] == "error":
+                    failed = True
+        if failed:
+            # The status line was already 200; errors inside the stream are counted separately
+            self.statuses["query_stream"]["stream_error"] += 1
+            return
+        self.latencies["query_stream"].append(time.perf_counter() - started)
+        if first_token_at is not None:
+            self.first_token.append(first_token_at - started)
+
+    async def drive_queries(self, client: httpx.AsyncClient, duration: float) -> float:
+        """Run the closed-loop query workers for duration seconds; returns the measured wall time"""
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                try:
+                    await self._query(client)
+                except httpx.HTTPError as e:
+                    self.statuses["query_transport"][type(e).__name__] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return time.perf_counter() - started
+
+    async def run(self, duration: float, pdf_dir: Path) -> Dict:
+        limits = httpx.Limits(max_connections=self.concurrency + 4, max_keepalive_connections=self.concurrency + 4)
+        timeout = httpx.Timeout(300, connect=10)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            await self.setup_users(client)
+            await self.upload_documents(client, pdf_dir)
+            # Setup traffic is not part of the query measurements
+            for endpoint in ("query", "query_stream"):
+                self.latencies.pop(endpoint, None)
+                self.statuses.pop(endpoint, None)
+            print(f"Querying with {self.concurrency} concurrent clients for {duration:.0f}s...")
+            elapsed = await self.drive_queries(client, duration)
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict:
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.statuses)):
+            completed = len(self.latencies[endpoint])
+            endpoints[endpoint] = {
+                'completed': completed,
+                'statuses': {str(code): count for code, count in sorted(self.statuses[endpoint].items(), key=str)},
+                'latency': latency_summary(self.latencies[endpoint])
+            }
+            if endpoint.startswith("query"):
+                endpoints[endpoint]['throughput_per_second'] = completed / elapsed if elapsed else 0.0
+        if self.first_token:
+            endpoints['query_stream']['time_to_first_token'] = latency_summary(self.first_token)
+        completed = sum(len(self.latencies[endpoint]) for endpoint in ("query", "query_stream"))
+        return {
+            'duration_seconds': elapsed,
+            'concurrency': self.concurrency,
+            'queries_per_second': completed / elapsed if elapsed else 0.0,
+            'endpoints': endpoints
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test of the RAG API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--documents-per-user", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=5, help="Pages per generated PDF")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent query clients")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of query traffic")
+    parser.add_argument("--stream-ratio", type=float, default=0.5,
+                        help="Fraction of queries sent to /query/stream/ instead of /query/")
+    parser.add_argument("--model", default=None, help="Model to request (default: the API's default model)")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Let the answer cache serve repeats (by default every query runs the full pipeline)")
+    parser.add_argument("--email-domain", default=LOAD_TEST_EMAIL_DOMAIN)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.base_url, args.users, args.documents_per_user, args.pages, args.concurrency,
+                              args.stream_ratio, args.model, args.use_cache, args.seed, args.email_domain)
+    with tempfile.TemporaryDirectory(prefix="ragai-load-") as pdf_dir:
+        report = asyncio.run(generator.run(args.duration, Path(pdf_dir)))
+
+    print(f"{report['queries_per_second']:.1f} queries/sec over {report['duration_seconds']:.1f}s")
+    for endpoint, result in report['endpoints'].items():
+        latency = result['latency']
+        line = f"{endpoint}: {result['completed']} ok, statuses {result['statuses']}"
+        if latency:
+            line += f", p50 {latency['p50_ms']:.0f}ms p90 {latency['p90_ms']:.0f}ms p99 {latency['p99_ms']:.0f}ms"
+        if 'time_to_first_token' in result:
+            line += f", first token p50 {result['time_to_first_token']['p50_ms']:.0f}ms"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
@@ -1,18 +1,38 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import uvicorn
-from typing import List
+from typing import List, Literal, Optional
+import asyncio
+import logging
 import os
 import hashlib
 from pathlib import Path
-import requests
 import json
+import re
 
 from pdf_processor import PDFProcessor
 from vector_store import VectorStore
-from embeddings import EmbeddingGenerator
+from embeddings import EmbeddingBatcher, EmbeddingGenerator
+from cache import (
+    LRUCache,
+    SemanticCache,
+    ANSWER_CACHE_MAX_CHARS,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_CACHE_TTL,
+    normalize_query
+)
+from ingestion import IngestionQueue
+from metrics import MetricsMiddleware, registry
+from ollama_client import OllamaClient, OllamaResponseError, OllamaUnavailableError
 from auth import (
     auth_manager, 
     UserSignup, 
@@ -22,8 +42,24 @@ from auth import (
     UserProfile,
     get_current_user,
     get_current_active_user,
+    require_stats_access,
+    security,
     SecurityMiddleware
 )
+from rate_limit import (
+    AdmissionGate,
+    RateLimit,
+    MAX_PENDING_EMBEDDINGS,
+    MAX_PENDING_GENERATIONS,
+    RATE_LIMIT_AUTH_BURST,
+    RATE_LIMIT_AUTH_PER_MINUTE,
+    RATE_LIMIT_QUERY_BURST,
+    RATE_LIMIT_QUERY_PER_MINUTE,
+    RATE_LIMIT_UPLOAD_BURST,
+    RATE_LIMIT_UPLOAD_PER_MINUTE
+)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="RAG Pipeline API", version="1.0.0")
 
@@ -39,28 +75,145 @@ app.add_middleware(
 # Add security middleware after CORS
 app.add_middleware(SecurityMiddleware)
 
+# Added last so it is outermost and times the whole request, including the middleware above
+app.add_middleware(MetricsMiddleware)
+
 # Initialize components
 pdf_processor = PDFProcessor()
 embedding_generator = EmbeddingGenerator()
+# Concurrent queries share forward passes instead of each encoding a batch of one
+query_embedder = EmbeddingBatcher(embedding_generator)
+# Repeated questions skip the model entirely
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+# Repeated questions against an unchanged document set skip retrieval and generation
+answer_cache = LRUCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+# Paraphrases of an answered question are matched by their query embeddings
+semantic_answer_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL)
 vector_store = VectorStore()
 
+# Separate per-user and per-IP budgets so one tenant can't monopolize queries, uploads or logins
+query_rate_limit = RateLimit("query", RATE_LIMIT_QUERY_PER_MINUTE, RATE_LIMIT_QUERY_BURST)
+upload_rate_limit = RateLimit("upload", RATE_LIMIT_UPLOAD_PER_MINUTE, RATE_LIMIT_UPLOAD_BURST)
+auth_rate_limit = RateLimit("authentication", RATE_LIMIT_AUTH_PER_MINUTE, RATE_LIMIT_AUTH_BURST, ip_factor=1)
+# Requests beyond what the model and Ollama can work through are refused instead of queued
+embedding_gate = AdmissionGate("embedding", MAX_PENDING_EMBEDDINGS)
+generation_gate = AdmissionGate("generation", MAX_PENDING_GENERATIONS)
+
 # Create uploads directory
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploads are processed by background workers; the endpoints only enqueue them
+ingestion_queue = IngestionQueue(vector_store.db_path, UPLOAD_DIR, pdf_processor, embedding_generator, vector_store)
+
 # Ollama configuration
-OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 DEFAULT_MODEL = "qwen3:0.6b"  # Change this to your preferred model
+GENERATION_OPTIONS = {
+    "temperature": 0.1,
+    "top_p": 0.9,
+    "top_k": 40
+}
+
+# One pooled async client per worker, shared by every request
+ollama_client = OllamaClient(OLLAMA_BASE_URL)
 
 class QueryRequest(BaseModel):
     question: str
     top_k: int = 5
     model: str = DEFAULT_MODEL
+    nprobe: Optional[int] = None  # IVF lists to scan; more is slower but closer to exact
+    search_mode: Literal["vector", "hybrid"] = "vector"  # hybrid adds BM25 keyword matching
+    no_cache: bool = False  # skip the answer cache lookup; the fresh answer still replaces the cached one
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[dict]
     model_used: str
+    cached: bool = False
+
+async def embed_query(question: str):
+    """Embedding for a question, served from the query embedding cache when possible"""
+    text = normalize_query(question)
+    key = (embedding_generator.model_name, text)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        async with embedding_gate.slot():
+            embedding = await query_embedder.embed(text)
+        embedding.setflags(write=False)  # shared between requests
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+async def answer_cache_scope(request: QueryRequest, user_id: int) -> tuple:
+    """Everything but the question that a cached answer depends on; the corpus version is read
+    before retrieval so a document change made while the answer is generated leaves it stale"""
+    return (user_id, await run_in_threadpool(vector_store.get_corpus_version, user_id),
+            request.model, request.top_k, request.search_mode, request.nprobe)
+
+def answer_cache_key(scope: tuple, question: str) -> tuple:
+    return (*scope, normalize_query(question))
+
+def find_similar_answer(scope: tuple, question: str, query_embedding) -> Optional[dict]:
+    """Answer cached for a paraphrase of the question; also remembered under this exact wording"""
+    cached = semantic_answer_cache.get(scope, query_embedding)
+    if cached is not None:
+        answer_cache.put(answer_cache_key(scope, question), cached)
+    return cached
+
+def cache_answer(scope: tuple, question: str, query_embedding, answer: str, sources: List[dict]):
+    if answer and len(answer) <= ANSWER_CACHE_MAX_CHARS:
+        cached = {"answer": answer, "sources": sources}
+        answer_cache.put(answer_cache_key(scope, question), cached)
+        semantic_answer_cache.put(scope, query_embedding, cached)
+
+async def replay_answer_stream(cached: dict, model: str):
+    """Send a cached answer in the /query/stream/ event format"""
+    yield f"data: {json.dumps({'type': 'sources', 'data': cached['sources']})}\n\n"
+    # Replay word by word so clients render a cached answer the same way as a live one
+    for token in re.findall(r"\s*\S+", cached["answer"]):
+        yield f"data: {json.dumps({'type': 'token', 'data': token})}\n\n"
+    yield f"data: {json.dumps({'type': 'done', 'data': {'model_used': model, 'cached': True}})}\n\n"
+
+def run_vector_store_migration():
+    """Run the migration, reporting failures; every step is rerunnable, so the next startup completes it"""
+    try:
+        if vector_store.migrate_existing_documents():
+            logger.info("Vector store migration finished")
+        else:
+            logger.info("Vector store migration is being run by another worker")
+    except Exception:
+        logger.exception("Vector store migration failed; it will be retried on the next startup")
+
+@app.on_event("startup")
+async def migrate_vector_store():
+    """Convert legacy pickled embeddings in the background so startup is not delayed"""
+    app.state.migration = asyncio.get_running_loop().run_in_executor(None, run_vector_store_migration)
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    ingestion_queue.start()
+
+@app.on_event("shutdown")
+async def close_ollama_client():
+    await ollama_client.close()
+
+@app.on_event("shutdown")
+async def close_pdf_processor():
+    pdf_processor.close()
+
+@app.on_event("shutdown")
+async def close_query_embedder():
+    await query_embedder.close()
+
+@app.on_event("shutdown")
+async def close_password_hasher():
+    auth_manager.password_hasher.close()
+
+@app.on_event("shutdown")
+async def close_database_connections():
+    vector_store.pool.close_all()
+    ingestion_queue.pool.close_all()
+    auth_manager.db.pool.close_all()
 
 # Root endpoint for health check
 @app.get("/")
@@ -69,32 +222,38 @@ async def root():
     return {"message": "RAG Pipeline API", "version": "1.0.0", "status": "running"}
 
 # Authentication endpoints - make sure these are defined before middleware issues
-@app.post("/signup", response_model=TokenResponse)
+@app.post("/signup", response_model=TokenResponse, dependencies=[Depends(auth_rate_limit)])
 async def signup(user_data: UserSignup, request: Request):
     """User registration endpoint"""
     try:
         return await auth_manager.signup(user_data, request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/signin", response_model=TokenResponse)
+@app.post("/signin", response_model=TokenResponse, dependencies=[Depends(auth_rate_limit)])
 async def signin(user_data: UserSignin, request: Request):
     """User login endpoint"""
     try:
         return await auth_manager.signin(user_data, request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/refresh", response_model=TokenResponse)
+@app.post("/refresh", response_model=TokenResponse, dependencies=[Depends(auth_rate_limit)])
 async def refresh_token(refresh_request: RefreshTokenRequest):
     """Refresh access token endpoint"""
     return await auth_manager.refresh_token(refresh_request)
 
 @app.post("/logout")
-async def logout(current_user: UserProfile = Depends(get_current_user)):
-    """User logout endpoint"""
-    # Note: You'll need to extract the token from the request
-    # This is a simplified version
+async def logout(
+    current_user: UserProfile = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """User logout endpoint: revokes the access token used for this request"""
+    await auth_manager.logout(credentials.credentials)
     return {"message": "Logged out successfully"}
 
 @app.get("/profile", response_model=UserProfile)
@@ -102,90 +261,85 @@ async def get_profile(current_user: UserProfile = Depends(get_current_user)):
     """Get user profile endpoint"""
     return current_user
 
+async def enqueue_pdf(file: UploadFile, user_id: int) -> tuple:
+    """Validate an upload and queue it for ingestion; returns (status code, response body)"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    content = await file.read()
+    
+    # Generate file hash for deduplication
+    file_hash = hashlib.md5(content).hexdigest()
+    
+    # Check if file already processed
+    if await run_in_threadpool(vector_store.document_exists, file_hash, user_id):
+        return 200, {"message": "Document already processed", "document_id": file_hash}
+    
+    # Another user already uploaded this file: share its stored content instead of reprocessing it
+    document_id = await run_in_threadpool(vector_store.share_document, file_hash, file.filename, user_id)
+    if document_id is not None:
+        return 201, {"message": "PDF processed successfully", "document_id": document_id}
+    
+    job = await run_in_threadpool(ingestion_queue.enqueue, user_id, file.filename, content, file_hash)
+    return 202, {
+        "message": "PDF queued for processing",
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
+    }
+
 # Protected endpoints - now require authentication
 @app.post("/upload-pdf/")
 async def upload_pdf(
     file: UploadFile = File(...),
-    current_user: UserProfile = Depends(get_current_active_user)
+    current_user: UserProfile = Depends(upload_rate_limit.for_user())
 ):
-    """Upload and process a PDF file into vector embeddings"""
-    
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-    
+    """Queue a PDF for processing into vector embeddings; poll the returned job for progress"""
     try:
-        # Save uploaded file
-        file_path = UPLOAD_DIR / file.filename
-        content = await file.read()
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # Generate file hash for deduplication
-        file_hash = hashlib.md5(content).hexdigest()
-        
-        # Check if file already processed
-        if vector_store.document_exists(file_hash):
-            os.remove(file_path)
-            return JSONResponse(
-                content={"message": "Document already processed", "document_id": file_hash},
-                status_code=200
-            )
-        
-        # Process PDF
-        text_chunks = pdf_processor.extract_and_chunk(str(file_path))
-        
-        # Generate embeddings
-        embeddings = embedding_generator.generate_embeddings(text_chunks)
-        
-        # Store in vector database with user association
-        document_id = vector_store.store_document(
-            document_hash=file_hash,
-            filename=file.filename,
-            chunks=text_chunks,
-            embeddings=embeddings,
-            user_id=current_user.id  # Associate document with user
-        )
-        
-        # Clean up uploaded file
-        os.remove(file_path)
-        
-        return JSONResponse(
-            content={
-                "message": "PDF processed successfully",
-                "document_id": document_id,
-                "chunks_processed": len(text_chunks)
-            },
-            status_code=201
-        )
-        
+        status_code, result = await enqueue_pdf(file, current_user.id)
+    except HTTPException:
+        raise
     except Exception as e:
-        # Clean up on error
-        if file_path.exists():
-            os.remove(file_path)
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queueing PDF: {str(e)}")
+    
+    return JSONResponse(content=result, status_code=status_code)
 
 @app.post("/upload-multiple-pdfs/")
 async def upload_multiple_pdfs(
+    request: Request,
     files: List[UploadFile] = File(...),
     current_user: UserProfile = Depends(get_current_active_user)
 ):
-    """Upload and process multiple PDF files"""
+    """Queue multiple PDF files for processing; each file is charged to the upload budget"""
     results = []
     
     for file in files:
         try:
-            result = await upload_pdf(file, current_user)
+            upload_rate_limit.check(request, current_user.id)
+            _, result = await enqueue_pdf(file, current_user.id)
             results.append({"filename": file.filename, "status": "success", "result": result})
+        except HTTPException as e:
+            results.append({"filename": file.filename, "status": "error", "error": e.detail})
         except Exception as e:
             results.append({"filename": file.filename, "status": "error", "error": str(e)})
     
-    return JSONResponse(content={"results": results})
+    return JSONResponse(content={"results": results}, status_code=202)
+
+@app.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str,
+    current_user: UserProfile = Depends(get_current_active_user)
+):
+    """Report an ingestion job's stage, pages done, chunks embedded and any error"""
+    job = await run_in_threadpool(ingestion_queue.get_job, job_id, user_id=current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job)
 
 @app.get("/documents/")
 async def list_documents(current_user: UserProfile = Depends(get_current_active_user)):
     """List all processed documents for the current user"""
-    documents = vector_store.list_documents(user_id=current_user.id)
+    documents = await run_in_threadpool(vector_store.list_documents, user_id=current_user.id)
     return JSONResponse(content={"documents": documents})
 
 @app.delete("/documents/{document_id}")
@@ -194,7 +348,7 @@ async def delete_document(
     current_user: UserProfile = Depends(get_current_active_user)
 ):
     """Delete a document and its embeddings"""
-    success = vector_store.delete_document(document_id, user_id=current_user.id)
+    success = await run_in_threadpool(vector_store.delete_document, document_id, user_id=current_user.id)
     if success:
         return JSONResponse(content={"message": "Document deleted successfully"})
     else:
@@ -205,22 +359,77 @@ async def health_check():
     """Health check endpoint"""
     return JSONResponse(content={"status": "healthy"})
 
+@app.get("/cache/stats", dependencies=[Depends(require_stats_access)])
+async def cache_stats():
+    """Hit/miss counters for the in-process caches"""
+    return JSONResponse(content={
+        "query_embeddings": query_embedding_cache.stats(),
+        "answers": answer_cache.stats(),
+        "semantic_answers": semantic_answer_cache.stats(),
+        "auth_tokens": auth_manager.token_cache.stats(),
+        "auth_principals": auth_manager.principal_cache.stats()
+    })
+
+@app.get("/auth/stats", dependencies=[Depends(require_stats_access)])
+async def auth_stats():
+    """Password hashing pool load and latency"""
+    return JSONResponse(content={"password_hashing": auth_manager.password_hasher.stats()})
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_stats_access)])
+async def metrics():
+    """Request latencies and pipeline stage timings in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/limits/stats", dependencies=[Depends(require_stats_access)])
+async def limits_stats():
+    """Rate limiter and admission control counters"""
+    return JSONResponse(content={
+        "rate_limits": {
+            "query": query_rate_limit.stats(),
+            "upload": upload_rate_limit.stats(),
+            "authentication": auth_rate_limit.stats()
+        },
+        "admission": {
+            "embedding": embedding_gate.stats(),
+            "generation": generation_gate.stats()
+        }
+    })
+
 @app.post("/query/", response_model=QueryResponse)
 async def query_documents(
     request: QueryRequest,
-    current_user: UserProfile = Depends(get_current_active_user)
+    current_user: UserProfile = Depends(query_rate_limit.for_user())
 ):
     """Query documents using RAG with Ollama"""
     
     try:
+        cache_scope = await answer_cache_scope(request, current_user.id)
+        cached = answer_cache.get(answer_cache_key(cache_scope, request.question)) if not request.no_cache else None
+        
         # Generate embedding for the query
-        query_embedding = embedding_generator.generate_embeddings([request.question])[0]
+        if cached is None:
+            query_embedding = await embed_query(request.question)
+            if not request.no_cache:
+                cached = find_similar_answer(cache_scope, request.question, query_embedding)
+        
+        if cached is not None:
+            return QueryResponse(
+                answer=cached["answer"],
+                sources=cached["sources"],
+                model_used=request.model,
+                cached=True
+            )
         
         # Search for similar chunks (scoped to user's documents)
-        similar_chunks = vector_store.search_similar(
-            query_embedding, 
+        # Index scan and SQLite lookups run on a worker thread, off the event loop
+        similar_chunks = await run_in_threadpool(
+            vector_store.search_similar,
+            query_embedding,
             top_k=request.top_k,
-            user_id=current_user.id
+            user_id=current_user.id,
+            nprobe=request.nprobe,
+            query_text=request.question,
+            mode=request.search_mode
         )
         
         if not similar_chunks:
@@ -243,25 +452,8 @@ Question: {request.question}
 Answer:"""
 
         # Query Ollama
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": request.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "top_p": 0.9,
-                    "top_k": 40
-                }
-            },
-            timeout=60
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Ollama error: {response.text}")
-        
-        ollama_response = response.json()
+        async with generation_gate.slot():
+            ollama_response = await ollama_client.generate(request.model, prompt, GENERATION_OPTIONS)
         answer = ollama_response.get("response", "").strip()
         
         # Prepare sources information
@@ -273,6 +465,7 @@ Answer:"""
             }
             for chunk in similar_chunks
         ]
+        cache_answer(cache_scope, request.question, query_embedding, answer, sources)
         
         return QueryResponse(
             answer=answer,
@@ -280,8 +473,12 @@ Answer:"""
             model_used=request.model
         )
         
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except OllamaUnavailableError as e:
         raise HTTPException(status_code=503, detail=f"Could not connect to Ollama: {str(e)}")
+    except OllamaResponseError as e:
+        raise HTTPException(status_code=500, detail=f"Ollama error: {e.detail}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
@@ -289,33 +486,45 @@ Answer:"""
 async def get_available_models():
     """Get list of available Ollama models"""
     try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=10)
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            return JSONResponse(content={"models": [model["name"] for model in models]})
-        else:
-            raise HTTPException(status_code=503, detail="Could not fetch models from Ollama")
-    except requests.exceptions.RequestException:
+        models = await ollama_client.list_models()
+        return JSONResponse(content={"models": models})
+    except OllamaResponseError:
+        raise HTTPException(status_code=503, detail="Could not fetch models from Ollama")
+    except OllamaUnavailableError:
         raise HTTPException(status_code=503, detail="Ollama service not available")
 
 @app.post("/query/stream/")
 async def query_documents_stream(
     request: QueryRequest,
-    current_user: UserProfile = Depends(get_current_active_user)
+    current_user: UserProfile = Depends(query_rate_limit.for_user())
 ):
     """Query documents with streaming response from Ollama"""
     from fastapi.responses import StreamingResponse
     import json
     
     try:
+        cache_scope = await answer_cache_scope(request, current_user.id)
+        cached = answer_cache.get(answer_cache_key(cache_scope, request.question)) if not request.no_cache else None
+        
         # Generate embedding for the query
-        query_embedding = embedding_generator.generate_embeddings([request.question])[0]
+        if cached is None:
+            query_embedding = await embed_query(request.question)
+            if not request.no_cache:
+                cached = find_similar_answer(cache_scope, request.question, query_embedding)
+        
+        if cached is not None:
+            return StreamingResponse(replay_answer_stream(cached, request.model), media_type="text/plain")
         
         # Search for similar chunks (scoped to user's documents)
-        similar_chunks = vector_store.search_similar(
-            query_embedding, 
+        # Index scan and SQLite lookups run on a worker thread, off the event loop
+        similar_chunks = await run_in_threadpool(
+            vector_store.search_similar,
+            query_embedding,
             top_k=request.top_k,
-            user_id=current_user.id
+            user_id=current_user.id,
+            nprobe=request.nprobe,
+            query_text=request.question,
+            mode=request.search_mode
         )
         
         if not similar_chunks:
@@ -335,8 +544,11 @@ Context:
 Question: {request.question}
 
 Answer:"""
+        
+        # Refuse while the response status can still say so; the slot is taken once streaming starts
+        generation_gate.ensure_capacity()
 
-        def generate_stream():
+        async def generate_stream():
             try:
                 # Send sources first
                 sources = [
@@ -351,39 +563,31 @@ Answer:"""
                 yield f"data: {json.dumps({'type': 'sources', 'data': sources})}\n\n"
                 
                 # Stream response from Ollama
-                response = requests.post(
-                    f"{OLLAMA_BASE_URL}/api/generate",
-                    json={
-                        "model": request.model,
-                        "prompt": prompt,
-                        "stream": True,
-                        "options": {
-                            "temperature": 0.1,
-                            "top_p": 0.9,
-                            "top_k": 40
-                        }
-                    },
-                    stream=True,
-                    timeout=60
-                )
-                
-                for line in response.iter_lines():
-                    if line:
-                        chunk_data = json.loads(line)
+                tokens = []
+                async with generation_gate.slot():
+                    async for chunk_data in ollama_client.stream_generate(request.model, prompt, GENERATION_OPTIONS):
                         if "response" in chunk_data:
+                            tokens.append(chunk_data["response"])
                             yield f"data: {json.dumps({'type': 'token', 'data': chunk_data['response']})}\n\n"
                         
+                        # Ollama closes the stream after the done chunk; running the loop to
+                        # completion releases the pooled connection instead of abandoning it
                         if chunk_data.get("done", False):
+                            cache_answer(cache_scope, request.question, query_embedding,
+                                         "".join(tokens).strip(), sources)
                             yield f"data: {json.dumps({'type': 'done', 'data': {'model_used': request.model}})}\n\n"
-                            break
                             
             except Exception as e:
                 yield f"data: {json.dumps({'type': 'error', 'data': str(e)})}\n\n"
         
         return StreamingResponse(generate_stream(), media_type="text/plain")
     
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except OllamaUnavailableError as e:
         raise HTTPException(status_code=503, detail=f"Could not connect to Ollama: {str(e)}")
+    except OllamaResponseError as e:
+        raise HTTPException(status_code=500, detail=f"Ollama error: {e.detail}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
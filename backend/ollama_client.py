@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import httpx
+from typing import AsyncIterator, Dict, List, Optional
+
+from metrics import OLLAMA_TIME_TO_FIRST_TOKEN, record_generation
+
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Generation can legitimately take a while; this bounds the gap between bytes, not the whole answer
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "60"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+
+# Transient upstream statuses worth retrying before any output has been produced
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+class OllamaUnavailableError(Exception):
+    """Ollama could not be reached (connection refused, timed out, ...)"""
+
+class OllamaResponseError(Exception):
+    """Ollama answered with a non-200 status"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class OllamaClient:
+    """Shared async client for the Ollama HTTP API with a persistent connection pool.
+
+    Requests never block the event loop, so concurrent queries on one worker
+    overlap instead of serializing behind a single generation.
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout: float = OLLAMA_READ_TIMEOUT, max_connections: int = OLLAMA_MAX_CONNECTIONS,
+                 max_keepalive: int = OLLAMA_MAX_KEEPALIVE, retries: int = OLLAMA_RETRIES,
+                 retry_backoff: float = OLLAMA_RETRY_BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _backoff(self, attempt: int, reason: str):
+        delay = self.retry_backoff * (2 ** attempt)
+        logger.warning(f"Ollama request failed ({reason}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def _request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """Send a request, retrying connection failures and transient 5xx responses"""
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if attempt == self.retries:
+                    raise OllamaUnavailableError(str(e)) from e
+                await self._backoff(attempt, type(e).__name__)
+                continue
+            except httpx.TimeoutException as e:
+                raise OllamaUnavailableError(f"Timed out waiting for Ollama: {e}") from e
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.retries:
+                await self._backoff(attempt, f"HTTP {response.status_code}")
+                continue
+            if response.status_code != 200:
+                raise OllamaResponseError(response.status_code, response.text)
+            return response
+
+    async def generate(self, model: str, prompt: str, options: Optional[Dict] = None) -> Dict:
+        """Run a non-streaming generation and return Ollama's JSON response"""
+        started = time.perf_counter()
+        response = await self._request("POST", "/api/generate", json={
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "options": options or {}
+        })
+        result = response.json()
+        record_generation(model, result, started)
+        return result
+
+    async def stream_generate(self, model: str, prompt: str, options: Optional[Dict] = None) -> AsyncIterator[Dict]:
+        """Yield Ollama's streamed JSON chunks as they arrive.
+
+        Connection failures are retried only until the first chunk has been
+        received; after that a retry would duplicate output.
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "options": options or {}
+        }
+        # Time to first token includes connecting and any retries, as the caller experiences it
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.client.stream("POST", "/api/generate", json=payload) as response:
+                    if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.retries:
+                        await self._backoff(attempt, f"HTTP {response.status_code}")
+                        continue
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise OllamaResponseError(response.status_code, response.text)
+
+                    first_token_at = None
+                    chunks = 0
+                    async for line in response.aiter_lines():
+                        if line:
+                            chunk = json.loads(line)
+                            if chunk.get("response"):
+                                chunks += 1
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    OLLAMA_TIME_TO_FIRST_TOKEN.observe(first_token_at - started, model=model)
+                            if chunk.get("done"):
+                                record_generation(model, chunk, started, first_token_at, chunks)
+                            yield chunk
+                    return
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt == self.retries:
+                    raise OllamaUnavailableError(str(e)) from e
+                await self._backoff(attempt, type(e).__name__)
+            except httpx.TimeoutException as e:
+                raise OllamaUnavailableError(f"Timed out waiting for Ollama: {e}") from e
+
+    async def list_models(self) -> List[str]:
+        """Names of the models installed in Ollama"""
+        response = await self._request("GET", "/api/tags", timeout=10)
+        return [model["name"] for model in response.json().get("models", [])]
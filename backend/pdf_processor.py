@@ -1,10 +1,30 @@
 import PyPDF2
-from typing import List
+from typing import Callable, Iterator, List, Optional
+import multiprocessing
+import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from metrics import STAGE_LATENCY
+
+# Worker processes for page extraction; 0 or 1 extracts serially in-process
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Documents shorter than this are not worth the round trip to the pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end); runs inside a pool worker, which opens its own reader"""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, end)]
+
 class PDFProcessor:
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 extraction_workers: int = PDF_EXTRACTION_WORKERS):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -12,23 +32,83 @@ class PDFProcessor:
             chunk_overlap=chunk_overlap,
             length_function=len,
         )
+        self.extraction_workers = extraction_workers
+        self._pool = None
+        if extraction_workers > 1:
+            self._start_pool()
     
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        
+    def _start_pool(self):
+        """Start the extraction pool up front, before the app spins up threads.
+
+        Fork is used where available: spawned workers would re-import the
+        launching script (``python main.py`` loads the embedding model at import
+        time), and a fork context starts every worker on the first submit, so
+        warming the pool here means no fork happens once other threads exist.
+        """
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self._pool = ProcessPoolExecutor(max_workers=self.extraction_workers, mp_context=context)
+        self._pool.submit(int).result()
+    
+    def close(self):
+        """Shut down the extraction pool"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+    
+    def iter_pages(self, pdf_path: str,
+                   on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """Yield page texts in page order, calling on_page(pages_done, total_pages) as pages finish.
+
+        Long documents are split into page ranges and extracted across the
+        process pool; only a bounded window of ranges is in flight at a time.
+        """
+        # Extraction time of the whole document, excluding time the consumer spends between pages
+        extract_seconds = 0.0
         try:
             with open(pdf_path, 'rb') as file:
+                started = time.perf_counter()
                 pdf_reader = PyPDF2.PdfReader(file)
+                total_pages = len(pdf_reader.pages)
+                extract_seconds += time.perf_counter() - started
+                
+                if self._pool is None or total_pages < PDF_PARALLEL_MIN_PAGES:
+                    for page_num, page in enumerate(pdf_reader.pages):
+                        started = time.perf_counter()
+                        page_text = page.extract_text()
+                        extract_seconds += time.perf_counter() - started
+                        if on_page:
+                            on_page(page_num + 1, total_pages)
+                        yield page_text
+                    STAGE_LATENCY.observe(extract_seconds, stage="extract")
+                    return
+            
+            ranges = deque((start, min(start + PDF_PAGES_PER_TASK, total_pages))
+                           for start in range(0, total_pages, PDF_PAGES_PER_TASK))
+            in_flight = deque()
+            pages_done = 0
+            while ranges or in_flight:
+                while ranges and len(in_flight) < 2 * self.extraction_workers:
+                    start, end = ranges.popleft()
+                    in_flight.append(self._pool.submit(extract_page_range, pdf_path, start, end))
                 
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-                    
+                started = time.perf_counter()
+                page_texts = in_flight.popleft().result()
+                extract_seconds += time.perf_counter() - started
+                pages_done += len(page_texts)
+                if on_page:
+                    on_page(pages_done, total_pages)
+                yield from page_texts
+            STAGE_LATENCY.observe(extract_seconds, stage="extract")
+        
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
-        
-        return text
+    
+    def extract_text_from_pdf(self, pdf_path: str,
+                              on_page: Optional[Callable[[int, int], None]] = None) -> str:
+        """Extract text from PDF file, calling on_page(pages_done, total_pages) as pages finish"""
+        return "".join(f"\n--- Page {page_num + 1} ---\n{page_text}"
+                       for page_num, page_text in enumerate(self.iter_pages(pdf_path, on_page)))
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize extracted text"""
@@ -46,17 +126,41 @@ class PDFProcessor:
     def chunk_text(self, text: str) -> List[str]:
         """Split text into chunks for processing"""
         chunks = self.text_splitter.split_text(text)
+        return self._keep_chunks(chunks)
+    
+    def iter_chunks(self, pdf_path: str,
+                    on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """Stream chunks page by page: extract, clean and split while holding only a few pages of text"""
+        buffer = ""
+        clean_seconds = chunk_seconds = 0.0
+        for page_num, page_text in enumerate(self.iter_pages(pdf_path, on_page)):
+            started = time.perf_counter()
+            cleaned_page = self.clean_text(f"\n--- Page {page_num + 1} ---\n{page_text}")
+            clean_seconds += time.perf_counter() - started
+            buffer = f"{buffer} {cleaned_page}" if buffer else cleaned_page
+            if len(buffer) < 4 * self.chunk_size:
+                continue
+            
+            # The last piece may continue onto the next page, so it starts the next buffer
+            # (it already overlaps the piece before it, so no overlap is lost)
+            started = time.perf_counter()
+            pieces = self.text_splitter.split_text(buffer)
+            chunk_seconds += time.perf_counter() - started
+            yield from self._keep_chunks(pieces[:-1])
+            buffer = pieces[-1] if pieces else ""
+        
+        if buffer:
+            started = time.perf_counter()
+            pieces = self.text_splitter.split_text(buffer)
+            chunk_seconds += time.perf_counter() - started
+            yield from self._keep_chunks(pieces)
+        STAGE_LATENCY.observe(clean_seconds, stage="clean")
+        STAGE_LATENCY.observe(chunk_seconds, stage="chunk")
+    
+    def _keep_chunks(self, chunks: List[str]) -> List[str]:
         return [chunk.strip() for chunk in chunks if len(chunk.strip()) > 50]
     
-    def extract_and_chunk(self, pdf_path: str) -> List[str]:
+    def extract_and_chunk(self, pdf_path: str,
+                          on_page: Optional[Callable[[int, int], None]] = None) -> List[str]:
         """Complete pipeline: extract, clean, and chunk PDF text"""
-        # Extract text
-        raw_text = self.extract_text_from_pdf(pdf_path)
-        
-        # Clean text
-        cleaned_text = self.clean_text(raw_text)
-        
-        # Chunk text
-        chunks = self.chunk_text(cleaned_text)
-        
-        return chunks
\ No newline at end of file
+        return list(self.iter_chunks(pdf_path, on_page))
\ No newline at end of file
@@ -0,0 +1,159 @@
+import argparse
+import io
+import os
+import numpy as np
+
+from ann_index import assign_to_centroids, kmeans
+from vector_index import FlatIndex, normalize_rows
+
+# Product quantization subspaces; 0 picks dim // 8 (1024-dim bge-m3 -> 128 bytes, 32x smaller)
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "0"))
+PQ_CENTROIDS = 256  # one byte per subspace code
+
+
+class ScalarQuantizer:
+    """Per-dimension 8-bit scalar quantization (4x smaller than float32)"""
+
+    kind = "int8"
+    code_dtype = np.uint8
+
+    def __init__(self, low: np.ndarray = None, scale: np.ndarray = None):
+        self.low = low
+        self.scale = scale
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    def train(self, vectors: np.ndarray):
+        """Fit each dimension's range, ignoring the extreme tails so outliers don't waste resolution"""
+        vectors = normalize_rows(vectors)
+        self.low = np.percentile(vectors, 0.1, axis=0).astype(np.float32)
+        high = np.percentile(vectors, 99.9, axis=0).astype(np.float32)
+        self.scale = np.maximum(high - self.low, 1e-6) / 255.0
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def score(self, codes: np.ndarray, query: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+        """Approximate x . query for every code row without materializing decoded vectors"""
+        # x ~= low + code * scale, so x . q ~= low . q + code . (scale * q)
+        weights = (self.scale * query).astype(np.float32)
+        bias = float(self.low @ query)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            block = codes[start:start + block_rows]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        return scores + bias
+
+    def state(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """Product quantization: one byte per subspace, scored with asymmetric distance lookup tables"""
+
+    kind = "pq"
+    code_dtype = np.uint8
+
+    def __init__(self, codebooks: np.ndarray = None, subspaces: int = PQ_SUBSPACES):
+        self.codebooks = codebooks  # (subspaces, centroids, sub_dim)
+        self.subspaces = len(codebooks) if codebooks is not None else subspaces
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def train(self, vectors: np.ndarray, iterations: int = 15):
+        vectors = normalize_rows(vectors)
+        dim = vectors.shape[1]
+        if not self.subspaces:
+            self.subspaces = max(1, dim // 8)
+        if dim % self.subspaces:
+            raise ValueError(f"Embedding dimension {dim} is not divisible into {self.subspaces} subspaces")
+
+        sub_dim = dim // self.subspaces
+        centroids = min(PQ_CENTROIDS, len(vectors))
+        self.codebooks = np.zeros((self.subspaces, centroids, sub_dim), dtype=np.float32)
+        for m in range(self.subspaces):
+            sub_vectors = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            self.codebooks[m] = kmeans(sub_vectors, centroids, iterations, spherical=False, seed=m)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            sub_vectors = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            codes[:, m] = assign_to_centroids(sub_vectors, self.codebooks[m], spherical=False)
+        return codes
+
+    def score(self, codes: np.ndarray, query: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+        """Approximate x . query as a sum of per-subspace table lookups"""
+        sub_queries = query.reshape(self.subspaces, -1)
+        tables = np.einsum("mkd,md->mk", self.codebooks, sub_queries)
+        # Flatten the tables so one gather covers every subspace at once
+        offsets = (np.arange(self.subspaces) * tables.shape[1]).astype(np.int64)
+        flat_tables = tables.ravel()
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            block = codes[start:start + block_rows]
+            scores[start:start + len(block)] = flat_tables[block + offsets].sum(axis=1)
+        return scores
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+
+QUANTIZERS = {
+    ScalarQuantizer.kind: ScalarQuantizer,
+    ProductQuantizer.kind: ProductQuantizer,
+}
+
+def serialize_quantizer(quantizer) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **quantizer.state())
+    return buffer.getvalue()
+
+def deserialize_quantizer(kind: str, blob: bytes):
+    with np.load(io.BytesIO(blob)) as state:
+        return QUANTIZERS[kind](**{name: state[name] for name in state.files})
+
+
+class QuantizedIndex(FlatIndex):
+    """FlatIndex that keeps quantizer codes instead of float32 rows.
+
+    Scores are estimates, so search results are first-pass candidates for
+    re-ranking against the full-precision vectors.
+    """
+
+    exact_scores = False
+
+    def __init__(self, quantizer, initial_capacity: int = 1024):
+        super().__init__(quantizer.code_size, initial_capacity, dtype=quantizer.code_dtype)
+        self.quantizer = quantizer
+
+    def _encode(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.quantizer.encode(normalize_rows(embeddings))
+
+    def _score(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return self.quantizer.score(matrix, query)
+
+
+if __name__ == "__main__":
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description="Train a quantizer and encode all stored embeddings")
+    parser.add_argument("--db", default="vector_store.db")
+    parser.add_argument("--kind", choices=sorted(QUANTIZERS), required=True)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    store = VectorStore(args.db, quantization=args.kind)
+    encoded = store.migrate_quantization(args.batch_size)
+    if store.quantizer is None:
+        raise SystemExit("Not enough stored embeddings to train a quantizer yet")
+    print(f"Encoded {encoded} embeddings with {args.kind} ({store.quantizer.code_size} bytes per vector)")
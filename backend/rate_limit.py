@@ -0,0 +1,158 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+
+from auth import UserProfile, auth_manager, get_current_active_user
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Sustained requests per minute and burst size, per user
+RATE_LIMIT_QUERY_PER_MINUTE = float(os.getenv("RATE_LIMIT_QUERY_PER_MINUTE", "30"))
+RATE_LIMIT_QUERY_BURST = int(os.getenv("RATE_LIMIT_QUERY_BURST", "10"))
+# Uploads are charged per file
+RATE_LIMIT_UPLOAD_PER_MINUTE = float(os.getenv("RATE_LIMIT_UPLOAD_PER_MINUTE", "20"))
+RATE_LIMIT_UPLOAD_BURST = int(os.getenv("RATE_LIMIT_UPLOAD_BURST", "10"))
+# Signup, signin and refresh carry no user yet, so their budget is per IP only
+RATE_LIMIT_AUTH_PER_MINUTE = float(os.getenv("RATE_LIMIT_AUTH_PER_MINUTE", "20"))
+RATE_LIMIT_AUTH_BURST = int(os.getenv("RATE_LIMIT_AUTH_BURST", "10"))
+# Several users can share one address (NAT, offices), so per-IP budgets are this many times the per-user ones
+RATE_LIMIT_IP_FACTOR = float(os.getenv("RATE_LIMIT_IP_FACTOR", "4"))
+# Buckets kept per limiter; the longest idle are dropped first (they would have refilled anyway)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Requests allowed to wait on the embedding model / Ollama before new ones are turned away with 503
+MAX_PENDING_EMBEDDINGS = int(os.getenv("MAX_PENDING_EMBEDDINGS", "64"))
+MAX_PENDING_GENERATIONS = int(os.getenv("MAX_PENDING_GENERATIONS", "32"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+class TokenBucketLimiter:
+    """Thread-safe token buckets keyed by client; each holds up to burst tokens refilled at rate_per_second"""
+
+    def __init__(self, rate_per_second: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate_per_second = rate_per_second
+        self.burst = max(1.0, burst)
+        self.max_keys = max(1, max_keys)
+        self._buckets: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key: Hashable, cost: float = 1) -> float:
+        """Take cost tokens from key's bucket; returns 0 if granted, else seconds until it could be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate_per_second)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (cost - tokens) / self.rate_per_second if self.rate_per_second > 0 else math.inf
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key: Hashable, cost: float = 1):
+        """Give back tokens granted to a request that was rejected by another limit after all"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + cost), updated)
+                self.allowed -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'keys': len(self._buckets), 'allowed': self.allowed, 'limited': self.limited}
+
+class RateLimit:
+    """Per-user and per-IP request budget for one class of routes, used as a FastAPI dependency.
+
+    ``Depends(limit)`` checks the client IP only (for anonymous routes);
+    ``Depends(limit.for_user())`` also authenticates the caller, checks their
+    own bucket and returns the user like ``get_current_active_user``.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int, ip_factor: float = RATE_LIMIT_IP_FACTOR,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.user_limiter = TokenBucketLimiter(per_minute / 60, burst)
+        self.ip_limiter = TokenBucketLimiter(per_minute * ip_factor / 60, burst * ip_factor)
+
+    def check(self, request: Request, user_id: Optional[int] = None, cost: float = 1):
+        """Charge the request to its user (if any) and IP; raises 429 with Retry-After when either is exhausted"""
+        if not self.enabled:
+            return
+        wait = self.user_limiter.acquire(user_id, cost) if user_id is not None else 0.0
+        if not wait:
+            wait = self.ip_limiter.acquire(auth_manager.get_client_ip(request), cost)
+            # Rejected on the IP budget: the request never ran, so the user is not charged for it
+            if wait and user_id is not None:
+                self.user_limiter.refund(user_id, cost)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Too many {self.name} requests, please slow down",
+                headers={"Retry-After": str(max(1, math.ceil(min(wait, 3600))))}
+            )
+
+    async def __call__(self, request: Request):
+        self.check(request)
+
+    def for_user(self):
+        async def dependency(request: Request,
+                             current_user: UserProfile = Depends(get_current_active_user)) -> UserProfile:
+            self.check(request, current_user.id)
+            return current_user
+        return dependency
+
+    def stats(self) -> Dict:
+        return {'per_user': self.user_limiter.stats(), 'per_ip': self.ip_limiter.stats()}
+
+class AdmissionGate:
+    """Caps the requests waiting on a shared backend (the embedding model, Ollama).
+
+    Past the cap new requests get a 503 with Retry-After at once, so under
+    overload latency stays bounded for the admitted ones instead of every
+    request queueing until it times out. Used from the event loop only.
+    """
+
+    def __init__(self, name: str, limit: int, retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self.name = name
+        self.limit = max(1, limit)
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def ensure_capacity(self):
+        """Raise 503 if the backend is saturated, without taking a slot"""
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"The {self.name} service is overloaded, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        self.ensure_capacity()
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        return {'limit': self.limit, 'in_flight': self.in_flight, 'admitted': self.admitted,
+                'rejected': self.rejected}
@@ -0,0 +1,350 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import ConnectionPool
+from vector_index import normalize_rows, top_k_indices
+
+# Rows per segment file. Files are created at full size but stay sparse
+# on disk until rows are actually written.
+SEGMENT_CAPACITY = int(os.getenv("SEGMENT_CAPACITY", "65536"))
+SEGMENT_MERGE_INTERVAL_SECONDS = int(os.getenv("SEGMENT_MERGE_INTERVAL_SECONDS", "300"))
+SEGMENT_MERGE_DEAD_RATIO = float(os.getenv("SEGMENT_MERGE_DEAD_RATIO", "0.3"))
+
+logger = logging.getLogger(__name__)
+
+class _SegmentView:
+    """Read-side view of one segment: the memmap plus the chunk id stored in each row"""
+
+    def __init__(self, segment_id: int, user_id: Optional[int], row_count: int, live_count: int,
+                 vectors: np.ndarray, ids: np.ndarray, document_rows: Dict[str, np.ndarray]):
+        self.segment_id = segment_id
+        self.user_id = user_id
+        self.row_count = row_count
+        self.live_count = live_count
+        self.vectors = vectors
+        self.ids = ids
+        self.live = ids != None  # noqa: E711 - elementwise comparison on an object array
+        self.document_rows = document_rows  # live rows of each document stored in this segment
+
+class SegmentStore:
+    """Embedding storage in per-user, append-only .npy segment files opened with np.memmap.
+
+    SQLite keeps only the segment catalogue and each chunk's (segment_id,
+    segment_row). Vectors are written pre-normalized, so a search is a
+    streamed matrix-vector product over the mapped files, and every worker
+    process shares the same pages through the OS page cache.
+    """
+
+    def __init__(self, db_path: str, root_dir: str, dtype: str = "float32",
+                 capacity: int = SEGMENT_CAPACITY, block_rows: int = 65536,
+                 pool: Optional[ConnectionPool] = None):
+        self.db_path = db_path
+        self.pool = pool or ConnectionPool(db_path)
+        self.root_dir = root_dir
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.block_rows = block_rows
+        self._views: Dict[int, _SegmentView] = {}
+        self._views_lock = threading.Lock()
+        self._merge_thread = None
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, relative_path: str) -> str:
+        return os.path.join(self.root_dir, relative_path)
+
+    def _create_segment(self, cursor, user_id: Optional[int], dim: int) -> Tuple[int, str]:
+        """Allocate an empty segment file and register it in the catalogue"""
+        user_dir = f"user_{user_id}" if user_id is not None else "shared"
+        os.makedirs(self._path(user_dir), exist_ok=True)
+
+        cursor.execute("""
+            INSERT INTO segments (user_id, path, dim, dtype, capacity)
+            VALUES (?, '', ?, ?, ?)
+        """, (user_id, dim, self.dtype.name, self.capacity))
+        segment_id = cursor.lastrowid
+        relative_path = os.path.join(user_dir, f"segment_{segment_id:08d}.npy")
+        cursor.execute("UPDATE segments SET path = ? WHERE id = ?", (relative_path, segment_id))
+
+        vectors = np.lib.format.open_memmap(
+            self._path(relative_path), mode="w+", dtype=self.dtype, shape=(self.capacity, dim)
+        )
+        del vectors
+        return segment_id, relative_path
+
+    def append(self, cursor, user_id: Optional[int], embeddings: np.ndarray) -> List[Tuple[int, int]]:
+        """Write embeddings into the user's active segment, returning (segment_id, row) per vector.
+
+        Must run inside a write transaction (BEGIN IMMEDIATE) so that no other
+        process claims the same rows; the row counts only become visible to
+        readers when the caller commits.
+        """
+        vectors = normalize_rows(embeddings).astype(self.dtype)
+        if not len(vectors):
+            return []
+        dim = vectors.shape[1]
+
+        locations = []
+        offset = 0
+        while offset < len(vectors):
+            cursor.execute("""
+                SELECT id, path, capacity, row_count FROM segments
+                WHERE user_id IS ? AND dim = ? AND NOT sealed
+                ORDER BY id DESC LIMIT 1
+            """, (user_id, dim))
+            row = cursor.fetchone()
+            if row:
+                segment_id, relative_path, capacity, row_count = row
+            else:
+                segment_id, relative_path = self._create_segment(cursor, user_id, dim)
+                capacity, row_count = self.capacity, 0
+
+            take = min(capacity - row_count, len(vectors) - offset)
+            mapped = np.load(self._path(relative_path), mmap_mode="r+")
+            mapped[row_count:row_count + take] = vectors[offset:offset + take]
+            mapped.flush()
+            del mapped
+
+            cursor.execute("""
+                UPDATE segments SET row_count = ?, live_count = live_count + ?, sealed = ?
+                WHERE id = ?
+            """, (row_count + take, take, row_count + take >= capacity, segment_id))
+
+            locations.extend((segment_id, r) for r in range(row_count, row_count + take))
+            offset += take
+
+        return locations
+
+    def release_document(self, cursor, document_id: str):
+        """Account for a document's rows becoming dead; call before deleting its chunks"""
+        cursor.execute("""
+            SELECT segment_id, COUNT(*) FROM chunks
+            WHERE document_id = ? AND segment_id IS NOT NULL
+            GROUP BY segment_id
+        """, (document_id,))
+        for segment_id, count in cursor.fetchall():
+            cursor.execute("UPDATE segments SET live_count = live_count - ? WHERE id = ?",
+                           (count, segment_id))
+
+    def read_rows(self, locations: List[Tuple[int, int]]) -> np.ndarray:
+        """Gather the vectors at the given (segment_id, row) locations, in order"""
+        segment_ids = np.fromiter((location[0] for location in locations), dtype=np.int64, count=len(locations))
+        rows = np.fromiter((location[1] for location in locations), dtype=np.int64, count=len(locations))
+        unique_ids = [int(segment_id) for segment_id in np.unique(segment_ids)]
+
+        with self.pool.connection() as conn:
+            placeholders = ",".join("?" * len(unique_ids))
+            paths = dict(conn.execute(
+                f"SELECT id, path FROM segments WHERE id IN ({placeholders})", unique_ids
+            ).fetchall())
+
+        output = None
+        for segment_id in unique_ids:
+            mapped = np.load(self._path(paths[segment_id]), mmap_mode="r")
+            if output is None:
+                output = np.empty((len(locations), mapped.shape[1]), dtype=np.float32)
+            selected = segment_ids == segment_id
+            output[selected] = mapped[rows[selected]]
+        return output
+
+    def _refresh(self) -> List[_SegmentView]:
+        """Return current views of all segments, reloading any the catalogue says changed"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, user_id, path, row_count, live_count FROM segments")
+            catalogue = cursor.fetchall()
+
+            views = []
+            with self._views_lock:
+                current = {row[0] for row in catalogue}
+                for segment_id in list(self._views):
+                    if segment_id not in current:
+                        del self._views[segment_id]
+
+                for segment_id, owner_id, relative_path, row_count, live_count in catalogue:
+                    view = self._views.get(segment_id)
+                    if view is None or view.row_count != row_count or view.live_count != live_count:
+                        cursor.execute(
+                            "SELECT id, segment_row, document_id FROM chunks WHERE segment_id = ?", (segment_id,)
+                        )
+                        ids = np.full(row_count, None, dtype=object)
+                        rows_by_document: Dict[str, List[int]] = {}
+                        for chunk_id, segment_row, document_id in cursor.fetchall():
+                            if segment_row < row_count:
+                                ids[segment_row] = chunk_id
+                                rows_by_document.setdefault(document_id, []).append(segment_row)
+                        document_rows = {document_id: np.sort(np.asarray(rows, dtype=np.int64))
+                                         for document_id, rows in rows_by_document.items()}
+
+                        vectors = view.vectors if view is not None else np.load(
+                            self._path(relative_path), mmap_mode="r"
+                        )
+                        view = _SegmentView(segment_id, owner_id, row_count, live_count, vectors, ids,
+                                            document_rows)
+                        self._views[segment_id] = view
+                    views.append(view)
+
+        return views
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               document_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Exact cosine search streamed block by block over the mapped segments.
+
+        With document_ids only the rows of those documents are scored, wherever
+        they are stored (shared content lives in its first uploader's segments).
+        """
+        try:
+            views = self._refresh()
+        except FileNotFoundError:
+            # A merge in another process retired a segment between our catalogue
+            # read and opening the file; the next catalogue read no longer lists it
+            views = self._refresh()
+
+        query = normalize_rows(query_embedding)[0]
+        wanted = set(document_ids) if document_ids is not None else None
+        candidate_ids = []
+        candidate_scores = []
+        for view in views:
+            if not view.live_count:
+                continue
+
+            if wanted is None:
+                for start in range(0, view.row_count, self.block_rows):
+                    end = min(start + self.block_rows, view.row_count)
+                    scores = (view.vectors[start:end] @ query).astype(np.float32)
+                    scores[~view.live[start:end]] = -np.inf
+                    for i in top_k_indices(scores, top_k):
+                        if np.isfinite(scores[i]):
+                            candidate_ids.append(view.ids[start + i])
+                            candidate_scores.append(float(scores[i]))
+                continue
+
+            selected = [rows for document_id, rows in view.document_rows.items() if document_id in wanted]
+            if not selected:
+                continue
+            rows = np.sort(np.concatenate(selected))
+            for start in range(0, len(rows), self.block_rows):
+                block = rows[start:start + self.block_rows]
+                scores = (view.vectors[block] @ query).astype(np.float32)
+                for i in top_k_indices(scores, top_k):
+                    candidate_ids.append(view.ids[block[i]])
+                    candidate_scores.append(float(scores[i]))
+
+        best = top_k_indices(np.asarray(candidate_scores, dtype=np.float32), top_k)
+        return [(candidate_ids[i], candidate_scores[i]) for i in best]
+
+    def merge(self, user_id: Optional[int]) -> int:
+        """Rewrite a user's sealed segments that are mostly dead or underfull into compact ones.
+
+        The whole merge runs in one write transaction, so concurrent appends and
+        merges in other processes wait rather than interleave. Returns the number
+        of segments retired.
+        """
+        retired_paths = []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT id, path, dim, row_count, live_count FROM segments
+                WHERE user_id IS ? AND sealed
+                ORDER BY id
+            """, (user_id,))
+
+            by_dim: Dict[int, List[Tuple]] = {}
+            for segment in cursor.fetchall():
+                segment_id, _, dim, row_count, live_count = segment
+                dead_ratio = (row_count - live_count) / row_count if row_count else 1.0
+                if dead_ratio >= SEGMENT_MERGE_DEAD_RATIO or live_count < self.capacity // 2:
+                    by_dim.setdefault(dim, []).append(segment)
+
+            retired = 0
+            for dim, segments in by_dim.items():
+                if len(segments) < 2 and all(s[3] == s[4] for s in segments):
+                    continue  # a lone underfull segment with no dead rows gains nothing
+
+                # Copy live rows in segment order into fresh, full-capacity segments
+                moves = []
+                output = None
+                for segment_id, relative_path, _, _, _ in segments:
+                    cursor.execute(
+                        "SELECT id, segment_row FROM chunks WHERE segment_id = ? ORDER BY segment_row",
+                        (segment_id,)
+                    )
+                    live_rows = cursor.fetchall()
+                    if not live_rows:
+                        continue
+                    source = np.load(self._path(relative_path), mmap_mode="r")
+                    rows = np.fromiter((r[1] for r in live_rows), dtype=np.int64, count=len(live_rows))
+
+                    offset = 0
+                    while offset < len(rows):
+                        if output is None or output[2] >= self.capacity:
+                            if output is not None:
+                                self._close_output(cursor, output)
+                            new_id, new_path = self._create_segment(cursor, user_id, dim)
+                            output = [new_id, np.load(self._path(new_path), mmap_mode="r+"), 0]
+                        take = min(self.capacity - output[2], len(rows) - offset)
+                        output[1][output[2]:output[2] + take] = source[rows[offset:offset + take]]
+                        moves.extend(
+                            (output[0], output[2] + i, live_rows[offset + i][0]) for i in range(take)
+                        )
+                        output[2] += take
+                        offset += take
+                    del source
+
+                if output is not None:
+                    self._close_output(cursor, output)
+
+                cursor.executemany(
+                    "UPDATE chunks SET segment_id = ?, segment_row = ? WHERE id = ?", moves
+                )
+                cursor.executemany("DELETE FROM segments WHERE id = ?", [(s[0],) for s in segments])
+                retired_paths.extend(s[1] for s in segments)
+                retired += len(segments)
+
+            cursor.execute("COMMIT")
+
+        # Processes that still map a retired file keep a valid view of the
+        # unlinked inode until their next catalogue refresh
+        for relative_path in retired_paths:
+            try:
+                os.remove(self._path(relative_path))
+            except FileNotFoundError:
+                pass
+
+        return retired
+
+    def _close_output(self, cursor, output: list):
+        """Flush a merge output segment and record its final row count (merged output is sealed)"""
+        segment_id, mapped, row_count = output
+        mapped.flush()
+        cursor.execute("""
+            UPDATE segments SET row_count = ?, live_count = ?, sealed = TRUE WHERE id = ?
+        """, (row_count, row_count, segment_id))
+
+    def merge_all(self) -> int:
+        """Run merge for every user that has sealed segments"""
+        with self.pool.connection() as conn:
+            user_ids = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM segments WHERE sealed")]
+        return sum(self.merge(user_id) for user_id in user_ids)
+
+    def start_background_merging(self, interval: int = SEGMENT_MERGE_INTERVAL_SECONDS):
+        """Start a daemon thread that periodically compacts segments"""
+        if self._merge_thread is not None:
+            return
+
+        def merge_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    retired = self.merge_all()
+                    if retired:
+                        logger.info(f"Merged {retired} embedding segments")
+                except Exception as e:
+                    logger.error(f"Error merging embedding segments: {e}")
+
+        self._merge_thread = threading.Thread(target=merge_loop, name="segment-merger", daemon=True)
+        self._merge_thread.start()
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import bulk_ingest
+from benchmark import StubEmbeddingGenerator
+from bulk_ingest import BulkIngester, file_hash
+from vector_store import VectorStore
+
+USER_ID = 1
+
+@pytest.fixture
+def store(tmp_path):
+    return VectorStore(str(tmp_path / "vector_store.db"))
+
+@pytest.fixture
+def pdfs(tmp_path, monkeypatch):
+    """A directory of stand-in PDFs; extraction is replaced so no PDF parser is needed"""
+    directory = tmp_path / "pdfs"
+    directory.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (directory / name).write_bytes(f"contents of {name}".encode())
+    monkeypatch.setattr(bulk_ingest, "extract_chunks",
+                        lambda path: [f"{path} chunk {i}" for i in range(3)])
+    return directory
+
+def ingest(store: VectorStore, directory) -> dict:
+    ingester = BulkIngester(store, StubEmbeddingGenerator(dim=8), USER_ID, workers=1, batch_size=1024)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return ingester.run(directory, executor)
+
+def test_interrupted_upload_is_left_to_its_job(store, pdfs):
+    interrupted = file_hash(pdfs / "a.pdf")
+    # An upload job registered the file and was interrupted before finalizing it
+    document_id, _ = store.create_document(interrupted, "a.pdf", USER_ID)
+
+    stats = ingest(store, pdfs)
+    assert stats['stored'] == 1 and stats['failed'] == 1
+    assert store.document_status(interrupted, USER_ID) == 'ingesting'
+    with store.pool.connection() as conn:
+        contents = conn.execute("SELECT COUNT(*) FROM document_contents WHERE document_hash = ?",
+                                (interrupted,)).fetchone()[0]
+    assert contents == 1
+
+    # Once the resumed job finishes the upload, the next run skips the file instead of failing it again
+    store.finalize_document(document_id)
+    stats = ingest(store, pdfs)
+    assert stats['skipped'] == 1 and stats['resumed'] == 1 and stats['failed'] == 0
+
+def test_store_documents_keeps_owned_documents(store):
+    embeddings = StubEmbeddingGenerator(dim=8).generate_embeddings(["x", "y"])
+    first = store.store_documents([("h1", "a.pdf", ["x", "y"], embeddings)], USER_ID)
+    assert store.store_documents([("h1", "a.pdf", ["x", "y"], embeddings)], USER_ID) == first
+
+    store.create_document("h2", "b.pdf", USER_ID)
+    with pytest.raises(ValueError):
+        store.store_documents([("h3", "c.pdf", ["z"], embeddings[:1]), ("h2", "b.pdf", ["x"], embeddings[:1])],
+                              USER_ID)
+    # Nothing from the rejected batch was written
+    assert store.document_status("h3", USER_ID) is None
+
+def test_failed_batch_stores_the_other_files(store, pdfs, monkeypatch):
+    store_documents = store.store_documents
+
+    def failing(documents, *args, **kwargs):
+        if any(filename == "b.pdf" for _, filename, _, _ in documents):
+            raise RuntimeError("disk I/O error")
+        return store_documents(documents, *args, **kwargs)
+
+    monkeypatch.setattr(store, "store_documents", failing)
+    stats = ingest(store, pdfs)
+    assert stats['stored'] == 1 and stats['failed'] == 1
+    assert store.document_status(file_hash(pdfs / "a.pdf"), USER_ID) == 'ready'
@@ -0,0 +1,145 @@
+import threading
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of the vectors scaled to unit length (zero rows stay zero)"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting the whole array"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class FlatIndex:
+    """Exact cosine search over a resident, pre-normalized float32 embedding matrix"""
+
+    # Whether search scores are true cosine similarities (subclasses holding
+    # compressed codes return estimates that callers should re-rank)
+    exact_scores = True
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, dtype=np.float32):
+        self.dim = dim
+        self._dtype = dtype
+        self._size = 0
+        self._capacity = 0
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix = None
+        self._ids = np.empty(0, dtype=object)
+        self._document_ids = np.empty(0, dtype=object)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, rows: int):
+        """Grow the backing arrays geometrically so appends stay amortized O(1)"""
+        required = self._size + rows
+        if required <= self._capacity:
+            return
+
+        capacity = max(self._initial_capacity, self._capacity)
+        while capacity < required:
+            capacity *= 2
+
+        matrix = np.zeros((capacity, self.dim), dtype=self._dtype)
+        ids = np.empty(capacity, dtype=object)
+        document_ids = np.empty(capacity, dtype=object)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            document_ids[:self._size] = self._document_ids[:self._size]
+
+        # Swap in new arrays rather than resizing in place so that searches
+        # holding a snapshot of the old arrays are unaffected
+        self._matrix, self._ids, self._document_ids = matrix, ids, document_ids
+        self._capacity = capacity
+
+    def _encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Turn raw embeddings into stored rows"""
+        return normalize_rows(embeddings)
+
+    def _score(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Similarity of every stored row to a normalized query"""
+        if query.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {matrix.shape[1]}")
+        return matrix @ query
+
+    def add(self, ids: List[str], document_ids: List[str], embeddings: np.ndarray):
+        """Append embeddings (normalized on the way in) with their chunk and document ids"""
+        if len(ids) == 0:
+            return
+        self.add_encoded(ids, document_ids, self._encode(embeddings))
+
+    def add_encoded(self, ids: List[str], document_ids: List[str], rows: np.ndarray):
+        """Append rows that are already in stored form (see _encode)"""
+        if len(rows) != len(ids) or len(ids) != len(document_ids):
+            raise ValueError("ids, document_ids and embeddings must have the same length")
+        if len(ids) == 0:
+            return
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = rows.shape[1]
+            elif rows.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {rows.shape[1]} does not match index dimension {self.dim}")
+
+            self._reserve(len(ids))
+            end = self._size + len(ids)
+            self._matrix[self._size:end] = rows
+            self._ids[self._size:end] = ids
+            self._document_ids[self._size:end] = document_ids
+            self._size = end
+
+    def remove_document(self, document_id: str) -> int:
+        """Drop every row belonging to a document, returning the number removed"""
+        with self._lock:
+            if not self._size:
+                return 0
+
+            keep = self._document_ids[:self._size] != document_id
+            removed = self._size - int(keep.sum())
+            if not removed:
+                return 0
+
+            # Compact into fresh arrays (see _reserve for why not in place)
+            self._matrix = np.ascontiguousarray(self._matrix[:self._size][keep])
+            self._ids = self._ids[:self._size][keep]
+            self._document_ids = self._document_ids[:self._size][keep]
+            self._size = self._capacity = len(self._ids)
+            return removed
+
+    def rows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Snapshot of (chunk ids, document ids, stored rows) for the current rows"""
+        with self._lock:
+            size = self._size
+            if not size:
+                return np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty((0, self.dim or 0), dtype=self._dtype)
+            return self._ids[:size], self._document_ids[:size], self._matrix[:size]
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        """Return (chunk_id, cosine similarity) pairs for the top_k closest rows"""
+        with self._lock:
+            size = self._size
+            if not size:
+                return []
+            matrix = self._matrix[:size]
+            ids = self._ids[:size]
+
+        scores = self._score(matrix, normalize_rows(query_embedding)[0])
+        best = top_k_indices(scores, top_k)
+        return [(ids[i], float(scores[i])) for i in best]
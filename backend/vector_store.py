@@ -1,20 +1,132 @@
-import sqlite3
+import hashlib
 import numpy as np
+import os
 import pickle
-from typing import List, Dict, Optional
+import re
+import threading
+from typing import List, Dict, Optional, Tuple
 import uuid
 
+from db import ConnectionPool
+from metrics import timed
+from vector_index import FlatIndex, normalize_rows
+from ann_index import IVFFlatIndex
+from segment_store import SegmentStore
+from quantization import QUANTIZERS, QuantizedIndex, deserialize_quantizer, serialize_quantizer
+
+# On-disk embedding encodings: raw little-endian floats, no pickle framing
+EMBEDDING_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+# Where full-precision vectors live: "sqlite" keeps them as BLOBs in the chunks
+# table, "mmap" keeps them in memory-mapped segment files next to the database
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "sqlite")
+
+# Resident search index: "flat" is exact brute force, "ivf" is approximate (see ann_index.py)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "flat")
+
+# First-pass scan over compressed codes: "none", "int8" (scalar) or "pq" (product
+# quantization). Candidates are re-scored against full-precision vectors.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+QUANTIZATION_RERANK_FACTOR = int(os.getenv("QUANTIZATION_RERANK_FACTOR", "4"))
+QUANTIZER_MIN_TRAIN_SIZE = int(os.getenv("QUANTIZER_MIN_TRAIN_SIZE", "1024"))
+QUANTIZER_TRAIN_SAMPLE = int(os.getenv("QUANTIZER_TRAIN_SAMPLE", "20000"))
+
+# Hybrid search pulls this many times top_k candidates from each ranker before fusing
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "4"))
+RRF_K = 60
+# The worker running the startup migration refreshes its lock after every step; one silent this long is presumed dead
+MIGRATION_LOCK_STALE_SECONDS = int(os.getenv("MIGRATION_LOCK_STALE_SECONDS", "3600"))
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float32") -> bytes:
+    """Serialize an embedding as raw little-endian bytes"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPES[dtype]).tobytes()
+
+def decode_embedding(blob: bytes, dtype: Optional[str], dim: Optional[int] = None) -> np.ndarray:
+    """Decode a stored embedding; raw rows are read-only views over the blob, not copies"""
+    if dtype is None:
+        # Legacy row written with pickle.dumps before the raw format existed
+        return pickle.loads(blob)
+    
+    embedding = np.frombuffer(blob, dtype=EMBEDDING_DTYPES[dtype])
+    if dim is not None and embedding.shape[0] != dim:
+        raise ValueError(f"Stored embedding has {embedding.shape[0]} values, expected {dim}")
+    return embedding
+
+def chunk_content_hash(text: str, model_name: str) -> str:
+    """Content address of a chunk's embedding: identical text under the same model embeds identically"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query that matches any of its terms"""
+    terms = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[tuple]:
+    """Fuse ranked id lists by summing 1 / (k + rank); returns (id, score) best first"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
 class VectorStore:
-    def __init__(self, db_path: str = "vector_store.db"):
+    def __init__(self, db_path: str = "vector_store.db", embedding_dtype: str = EMBEDDING_STORAGE_DTYPE,
+                 storage: str = VECTOR_STORAGE, segment_dir: Optional[str] = None,
+                 index_type: str = VECTOR_INDEX, index_dir: Optional[str] = None,
+                 quantization: str = VECTOR_QUANTIZATION):
+        if embedding_dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {embedding_dtype}")
+        if storage not in ("sqlite", "mmap"):
+            raise ValueError(f"Unsupported storage engine: {storage}")
+        if index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unsupported index type: {index_type}")
+        if quantization != "none" and quantization not in QUANTIZERS:
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        if quantization != "none" and index_type != "flat":
+            raise ValueError("Quantization is only supported with the flat index")
+        
         self.db_path = db_path
+        # chunks.document_id holds content ids, which the legacy foreign key on
+        # documents(id) does not describe, so foreign keys stay unenforced here
+        self.pool = ConnectionPool(db_path, foreign_keys=False)
+        self.embedding_dtype = embedding_dtype
+        self.storage = storage
+        self.index_type = index_type
+        self.quantization = quantization
+        self.index_dir = index_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "indexes")
+        # Resident per-user search indexes, loaded lazily on first search.
+        # The None key holds the unscoped index used when no user is given.
+        self._indexes: Dict[Optional[int], object] = {}
+        self._index_lock = threading.RLock()
         self.init_database()
+        
+        # Deployment-wide quantizer, trained once enough embeddings are stored
+        self.quantizer = None
+        self.quantizer_id = None
+        if quantization != "none":
+            self._load_quantizer()
+        
+        self.segments = None
+        if storage == "mmap":
+            if segment_dir is None:
+                segment_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "segments")
+            self.segments = SegmentStore(db_path, segment_dir, embedding_dtype, pool=self.pool)
+            self.segments.start_background_merging()
+            # Rows still held as BLOBs (legacy data, or not yet moved by migrate_to_segments)
+            # are scanned alongside the segments until the migration has moved them all
+            self._unsegmented = self._has_unsegmented_chunks()
     
     def init_database(self):
         """Initialize SQLite database with tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
-            # Documents table - now includes user_id
+            # Documents table - one row per user owning a file; the chunks live
+            # once per file hash in document_contents, shared by every owner
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS documents (
                     id TEXT PRIMARY KEY,
@@ -23,10 +135,39 @@ class VectorStore:
                     user_id INTEGER,
                     upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     chunk_count INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'ready',
+                    content_id TEXT,
                     UNIQUE(document_hash, user_id)
                 )
             """)
             
+            # Documents are 'ingesting' while their chunks are streamed in batch by batch
+            cursor.execute("PRAGMA table_info(documents)")
+            document_columns = [column[1] for column in cursor.fetchall()]
+            if "status" not in document_columns:
+                cursor.execute("ALTER TABLE documents ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
+            if "content_id" not in document_columns:
+                cursor.execute("ALTER TABLE documents ADD COLUMN content_id TEXT")
+            
+            # Physical document content; chunks.document_id refers to these ids
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS document_contents (
+                    id TEXT PRIMARY KEY,
+                    document_hash TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'ready',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Documents stored before content sharing own their chunks directly: reuse
+            # the document id as the content id so no chunk row has to change
+            cursor.execute("""
+                INSERT OR IGNORE INTO document_contents (id, document_hash, chunk_count, status)
+                SELECT id, document_hash, chunk_count, status FROM documents WHERE content_id IS NULL
+            """)
+            cursor.execute("UPDATE documents SET content_id = id WHERE content_id IS NULL")
+            
             # Chunks table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS chunks (
@@ -35,124 +176,752 @@ class VectorStore:
                     chunk_index INTEGER NOT NULL,
                     content TEXT NOT NULL,
                     embedding BLOB NOT NULL,
+                    dim INTEGER,
+                    dtype TEXT,
+                    model_name TEXT,
+                    segment_id INTEGER,
+                    segment_row INTEGER,
+                    code BLOB,
+                    quantizer_id INTEGER,
+                    fts_rowid INTEGER,
+                    content_hash TEXT,
                     FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE
                 )
             """)
             
+            # Databases created before the raw embedding format lack these columns;
+            # rows with a NULL dtype are still pickled until migrated
+            cursor.execute("PRAGMA table_info(chunks)")
+            chunk_columns = [column[1] for column in cursor.fetchall()]
+            for column, column_type in (("dim", "INTEGER"), ("dtype", "TEXT"), ("model_name", "TEXT"),
+                                        ("segment_id", "INTEGER"), ("segment_row", "INTEGER"),
+                                        ("code", "BLOB"), ("quantizer_id", "INTEGER"),
+                                        ("fts_rowid", "INTEGER"), ("content_hash", "TEXT")):
+                if column not in chunk_columns:
+                    cursor.execute(f"ALTER TABLE chunks ADD COLUMN {column} {column_type}")
+            
+            # Catalogue of memory-mapped embedding segments (mmap storage engine)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    path TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    dtype TEXT NOT NULL,
+                    capacity INTEGER NOT NULL,
+                    row_count INTEGER NOT NULL DEFAULT 0,
+                    live_count INTEGER NOT NULL DEFAULT 0,
+                    sealed BOOLEAN DEFAULT FALSE
+                )
+            """)
+            
+            # Contentless full-text index over chunk content for BM25 retrieval. Its
+            # rowids are kept in chunks.fts_rowid (implicit rowids change on VACUUM),
+            # and deletes replay the original text from chunks.content.
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(content, content='')
+            """)
+            
+            # Trained quantizers; chunk codes are only valid for the quantizer_id they were encoded with
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS quantizers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    state BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Bumped whenever the set of chunks a user can search changes, so anything
+            # derived from search results (cached answers) can be keyed on it.
+            # Documents without an owner are counted under user_id 0.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS corpus_versions (
+                    user_id INTEGER PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            
+            # At most one row: the process currently running migrate_existing_documents
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS migration_lock (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    holder TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
             # Create indices for better performance
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_hash ON documents (document_hash)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_id ON chunks (document_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON documents (user_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_hash ON documents (user_id, document_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_segment ON chunks (segment_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_fts ON chunks (fts_rowid)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_content_hash ON chunks (content_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_segment_user ON segments (user_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_content ON documents (content_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_content_hash ON document_contents (document_hash)")
             
             conn.commit()
     
     def document_exists(self, document_hash: str, user_id: Optional[int] = None) -> bool:
-        """Check if document already exists for the user"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Check if a fully ingested document already exists for the user"""
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             if user_id is not None:
-                cursor.execute("SELECT 1 FROM documents WHERE document_hash = ? AND user_id = ?", 
+                cursor.execute("SELECT 1 FROM documents WHERE document_hash = ? AND user_id = ? AND status = 'ready'", 
                              (document_hash, user_id))
             else:
-                cursor.execute("SELECT 1 FROM documents WHERE document_hash = ?", (document_hash,))
+                cursor.execute("SELECT 1 FROM documents WHERE document_hash = ? AND status = 'ready'", (document_hash,))
             return cursor.fetchone() is not None
     
+    def document_status(self, document_hash: str, user_id: Optional[int] = None) -> Optional[str]:
+        """Status of the user's own copy of a file ('ingesting' or 'ready'), or None if they have none"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status FROM documents WHERE document_hash = ? AND user_id IS ?",
+                           (document_hash, user_id))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
     def store_document(self, document_hash: str, filename: str, chunks: List[str], 
-                      embeddings: np.ndarray, user_id: Optional[int] = None) -> str:
-        """Store document and its embeddings"""
-        document_id = str(uuid.uuid4())
+                      embeddings: np.ndarray, user_id: Optional[int] = None,
+                      model_name: Optional[str] = None) -> str:
+        """Store document and its embeddings (or just take ownership if the content is already stored)"""
+        return self.store_documents([(document_hash, filename, chunks, embeddings)], user_id, model_name)[0]
+    
+    @timed("store")
+    def store_documents(self, documents: List[Tuple[str, str, List[str], np.ndarray]],
+                        user_id: Optional[int] = None, model_name: Optional[str] = None) -> List[str]:
+        """Store several (document_hash, filename, chunks, embeddings) documents in one write transaction.
         
-        with sqlite3.connect(self.db_path) as conn:
+        Content that is already stored is shared instead of written again, and a
+        document the user already owns is kept as is. Returns the document ids in
+        input order; raises ValueError (writing nothing) if the user's own upload
+        of one of the files is still being ingested.
+        """
+        document_ids = []
+        shared_contents = []
+        written_contents = []
+        
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
+            # Take the write lock up front so no other process claims the same segment rows
+            cursor.execute("BEGIN IMMEDIATE")
             
-            # Store document metadata
-            cursor.execute("""
-                INSERT INTO documents (id, document_hash, filename, user_id, chunk_count)
-                VALUES (?, ?, ?, ?, ?)
-            """, (document_id, document_hash, filename, user_id, len(chunks)))
-            
-            # Store chunks and embeddings
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_id = str(uuid.uuid4())
-                embedding_blob = pickle.dumps(embedding)
+            for document_hash, filename, chunks, embeddings in documents:
+                cursor.execute("SELECT id, status FROM documents WHERE document_hash = ? AND user_id IS ?",
+                               (document_hash, user_id))
+                owned = cursor.fetchone()
+                if owned is not None:
+                    # An interrupted upload is finished by its resumed job, not written a second time here
+                    if owned[1] != 'ready':
+                        raise ValueError(f"Document {document_hash} is still being ingested for this user")
+                    document_ids.append(owned[0])
+                    continue
                 
-                cursor.execute("""
-                    INSERT INTO chunks (id, document_id, chunk_index, content, embedding)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (chunk_id, document_id, i, chunk, embedding_blob))
+                document_id = str(uuid.uuid4())
+                content = self._find_content(cursor, document_hash)
+                if content is not None and content[1] == 'ready':
+                    content_id, _, chunk_count = content
+                    self._add_owner(cursor, document_id, content_id, document_hash, filename, user_id, 'ready', chunk_count)
+                    shared_contents.append(content_id)
+                else:
+                    # Store document metadata
+                    content_id = str(uuid.uuid4())
+                    cursor.execute("""
+                        INSERT INTO document_contents (id, document_hash, chunk_count)
+                        VALUES (?, ?, ?)
+                    """, (content_id, document_hash, len(chunks)))
+                    self._add_owner(cursor, document_id, content_id, document_hash, filename, user_id, 'ready', len(chunks))
+                    chunk_ids = (self._insert_chunks(cursor, content_id, chunks, embeddings, 0, user_id, model_name)
+                                 if len(chunks) else [])
+                    written_contents.append((content_id, chunk_ids, embeddings))
+                document_ids.append(document_id)
             
-            conn.commit()
+            if shared_contents or written_contents:
+                self._bump_corpus_version(cursor, [user_id])
+            
+            # Same contract as _commit_chunks/_commit_owner, for the whole batch at once
+            with self._index_lock:
+                conn.commit()
+                for index in self._loaded_indexes(user_id):
+                    for content_id, chunk_ids, embeddings in written_contents:
+                        if chunk_ids:
+                            index.add(chunk_ids, [content_id] * len(chunk_ids), np.asarray(embeddings[:len(chunk_ids)]))
+                
+                user_index = self._indexes.get(user_id) if user_id is not None else None
+                if user_index is not None:
+                    for content_id in shared_contents:
+                        for chunk_ids, content_ids, embeddings in self._iter_content_embeddings(content_id):
+                            user_index.add(chunk_ids, content_ids, embeddings)
         
+        return document_ids
+    
+    def share_document(self, document_hash: str, filename: str, user_id: Optional[int] = None) -> Optional[str]:
+        """Give the user a document whose content is already fully stored, without reprocessing it.
+        
+        Returns the user's document id, or None if no ready copy of the content exists.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id, status FROM documents WHERE document_hash = ? AND user_id IS ?",
+                           (document_hash, user_id))
+            owned = cursor.fetchone()
+            if owned is not None:
+                conn.rollback()
+                return owned[0] if owned[1] == 'ready' else None
+            
+            content = self._find_content(cursor, document_hash)
+            if content is None or content[1] != 'ready':
+                conn.rollback()
+                return None
+            
+            document_id = str(uuid.uuid4())
+            content_id, _, chunk_count = content
+            self._add_owner(cursor, document_id, content_id, document_hash, filename, user_id, 'ready', chunk_count)
+            self._bump_corpus_version(cursor, [user_id])
+            self._commit_owner(conn, content_id, user_id)
         return document_id
     
+    def create_document(self, document_hash: str, filename: str,
+                        user_id: Optional[int] = None) -> Tuple[str, int]:
+        """Register a document whose chunks will be streamed in with append_chunks.
+        
+        Returns (document_id, chunks already stored). An interrupted ingestion of
+        the same file is resumed rather than restarted, so callers should skip
+        that many leading chunks.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id, content_id FROM documents WHERE document_hash = ? AND user_id IS ?",
+                           (document_hash, user_id))
+            row = cursor.fetchone()
+            if row is not None:
+                document_id, content_id = row
+                conn.commit()
+            else:
+                content = self._find_content(cursor, document_hash)
+                if content is not None:
+                    content_id, status, chunk_count = content
+                else:
+                    content_id, status, chunk_count = str(uuid.uuid4()), 'ingesting', 0
+                    cursor.execute("""
+                        INSERT INTO document_contents (id, document_hash, chunk_count, status)
+                        VALUES (?, ?, 0, 'ingesting')
+                    """, (content_id, document_hash))
+                document_id = str(uuid.uuid4())
+                self._add_owner(cursor, document_id, content_id, document_hash, filename, user_id, status, chunk_count)
+                self._bump_corpus_version(cursor, [user_id])
+                self._commit_owner(conn, content_id, user_id)
+            
+            # Count the chunks actually present; a crash can never leave chunk_count ahead of them
+            cursor.execute("SELECT COUNT(*) FROM chunks WHERE document_id = ?", (content_id,))
+            stored = cursor.fetchone()[0]
+        return document_id, stored
+    
+    @timed("store")
+    def append_chunks(self, document_id: str, chunks: List[str], embeddings: np.ndarray,
+                      start_index: int, user_id: Optional[int] = None,
+                      model_name: Optional[str] = None) -> List[str]:
+        """Durably add one batch of a streamed document's chunks, numbered from start_index"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if self.segments is not None:
+                cursor.execute("BEGIN IMMEDIATE")
+            
+            content_id = self._content_of(cursor, document_id)
+            chunk_ids = self._insert_chunks(cursor, content_id, chunks, embeddings, start_index,
+                                            user_id, model_name)
+            cursor.execute("UPDATE document_contents SET chunk_count = ? WHERE id = ?",
+                           (start_index + len(chunk_ids), content_id))
+            cursor.execute("UPDATE documents SET chunk_count = ? WHERE content_id = ?",
+                           (start_index + len(chunk_ids), content_id))
+            cursor.execute("SELECT user_id FROM documents WHERE content_id = ?", (content_id,))
+            owners = [row[0] for row in cursor.fetchall()]
+            self._bump_corpus_version(cursor, owners)
+            self._commit_chunks(conn, content_id, chunk_ids, embeddings, owners)
+        
+        return chunk_ids
+    
+    def finalize_document(self, document_id: str):
+        """Mark a streamed document (and every owner of its content) as fully ingested"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            content_id = self._content_of(cursor, document_id)
+            cursor.execute("SELECT COUNT(*) FROM chunks WHERE document_id = ?", (content_id,))
+            chunk_count = cursor.fetchone()[0]
+            cursor.execute("UPDATE document_contents SET status = 'ready', chunk_count = ? WHERE id = ?",
+                           (chunk_count, content_id))
+            cursor.execute("UPDATE documents SET status = 'ready', chunk_count = ? WHERE content_id = ?",
+                           (chunk_count, content_id))
+            cursor.execute("SELECT user_id FROM documents WHERE content_id = ?", (content_id,))
+            self._bump_corpus_version(cursor, [row[0] for row in cursor.fetchall()])
+            conn.commit()
+    
+    def get_corpus_version(self, user_id: Optional[int] = None) -> int:
+        """Version of the chunks visible to a user; changes whenever their search results may change.
+        
+        Without a user_id (unscoped search) this is the sum over all users, which
+        moves whenever any of them changes.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if user_id is not None:
+                cursor.execute("SELECT version FROM corpus_versions WHERE user_id = ?", (user_id,))
+            else:
+                cursor.execute("SELECT SUM(version) FROM corpus_versions")
+            row = cursor.fetchone()
+            return row[0] if row and row[0] else 0
+    
+    def _bump_corpus_version(self, cursor, user_ids: List[Optional[int]]):
+        """Advance the corpus version of every given owner inside the caller's transaction"""
+        for user_id in set(0 if user_id is None else user_id for user_id in user_ids):
+            cursor.execute("""
+                INSERT INTO corpus_versions (user_id, version) VALUES (?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+            """, (user_id,))
+    
+    def _find_content(self, cursor, document_hash: str) -> Optional[tuple]:
+        """(content_id, status, chunk_count) of the stored content for a file hash, preferring a ready copy"""
+        cursor.execute("""
+            SELECT id, status, chunk_count FROM document_contents
+            WHERE document_hash = ?
+            ORDER BY status = 'ready' DESC, created_at, id
+            LIMIT 1
+        """, (document_hash,))
+        return cursor.fetchone()
+    
+    def _content_of(self, cursor, document_id: str) -> str:
+        cursor.execute("SELECT content_id FROM documents WHERE id = ?", (document_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown document: {document_id}")
+        return row[0]
+    
+    def _add_owner(self, cursor, document_id: str, content_id: str, document_hash: str, filename: str,
+                   user_id: Optional[int], status: str, chunk_count: int):
+        cursor.execute("""
+            INSERT INTO documents (id, document_hash, filename, user_id, chunk_count, status, content_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (document_id, document_hash, filename, user_id, chunk_count, status, content_id))
+    
+    def _commit_owner(self, conn, content_id: str, user_id: Optional[int]):
+        """Commit a new ownership row and put the existing content into the user's resident index"""
+        with self._index_lock:
+            conn.commit()
+            index = self._indexes.get(user_id) if user_id is not None else None
+            if index is not None:
+                for chunk_ids, content_ids, embeddings in self._iter_content_embeddings(content_id):
+                    index.add(chunk_ids, content_ids, embeddings)
+    
+    def _insert_chunks(self, cursor, document_id: str, chunks: List[str], embeddings: np.ndarray,
+                       start_index: int, user_id: Optional[int], model_name: Optional[str]) -> List[str]:
+        """Write chunk rows (and their vectors, codes and full-text entries) inside the caller's transaction"""
+        # With mmap storage the vectors go to segment files and the row keeps only their location
+        locations = None
+        if self.segments is not None:
+            locations = self.segments.append(cursor, user_id, np.asarray(embeddings[:len(chunks)]))
+        
+        codes = None
+        if self.quantizer is not None:
+            codes = self.quantizer.encode(normalize_rows(embeddings[:len(chunks)]))
+        
+        # Store chunks and embeddings
+        chunk_ids = []
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            chunk_id = str(uuid.uuid4())
+            if locations is not None:
+                embedding_blob = b""
+                segment_id, segment_row = locations[i]
+            else:
+                embedding_blob = encode_embedding(embedding, self.embedding_dtype)
+                segment_id, segment_row = None, None
+            
+            code_blob = codes[i].tobytes() if codes is not None else None
+            
+            cursor.execute("INSERT INTO chunks_fts (content) VALUES (?)", (chunk,))
+            fts_rowid = cursor.lastrowid
+            
+            content_hash = chunk_content_hash(chunk, model_name) if model_name else None
+            
+            cursor.execute("""
+                INSERT INTO chunks (id, document_id, chunk_index, content, embedding, dim, dtype, model_name,
+                                    segment_id, segment_row, code, quantizer_id, fts_rowid, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (chunk_id, document_id, start_index + i, chunk, embedding_blob, len(embedding),
+                  self.embedding_dtype, model_name, segment_id, segment_row, code_blob,
+                  self.quantizer_id if codes is not None else None, fts_rowid, content_hash))
+            chunk_ids.append(chunk_id)
+        return chunk_ids
+    
+    def _commit_chunks(self, conn, content_id: str, chunk_ids: List[str], embeddings: np.ndarray,
+                       owners: List[Optional[int]]):
+        # Commit under the index lock so a concurrent index load either
+        # sees these rows or receives them here, never both
+        with self._index_lock:
+            conn.commit()
+            if chunk_ids:
+                for index in self._loaded_indexes(*owners):
+                    index.add(chunk_ids, [content_id] * len(chunk_ids), np.asarray(embeddings[:len(chunk_ids)]))
+    
+    @timed("search")
     def search_similar(self, query_embedding: np.ndarray, top_k: int = 5, 
-                      user_id: Optional[int] = None) -> List[Dict]:
-        """Search for similar chunks using cosine similarity, optionally filtered by user"""
-        with sqlite3.connect(self.db_path) as conn:
+                      user_id: Optional[int] = None, nprobe: Optional[int] = None,
+                      query_text: Optional[str] = None, mode: str = "vector") -> List[Dict]:
+        """Search for similar chunks using cosine similarity, optionally filtered by user.
+        
+        nprobe overrides the number of IVF lists scanned when the ivf index is in use.
+        mode="hybrid" also runs a BM25 full-text search for query_text and fuses both
+        rankings with reciprocal rank fusion.
+        """
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {mode}")
+        
+        hybrid = mode == "hybrid" and bool(query_text)
+        depth = top_k * HYBRID_CANDIDATE_FACTOR if hybrid else top_k
+        
+        rerank = False
+        if self.index_type == "ivf":
+            hits = self._get_index(user_id).search(query_embedding, depth, nprobe=nprobe)
+        elif self.segments is not None and self.quantization == "none":
+            # Exact search straight off the mapped segments, nothing made resident
+            document_ids = self._owned_contents(user_id) if user_id is not None else None
+            hits = self.segments.search(query_embedding, depth, document_ids)
+            if self._unsegmented:
+                hits = self._merge_hits(hits, self._search_unsegmented(query_embedding, depth, user_id), depth)
+        else:
+            index = self._get_index(user_id)
+            rerank = not index.exact_scores
+            hits = index.search(query_embedding, depth * QUANTIZATION_RERANK_FACTOR if rerank else depth)
+        
+        lexical = self._search_fulltext(query_text, depth, user_id) if hybrid else []
+        candidate_ids = list(dict.fromkeys([chunk_id for chunk_id, _ in hits] + lexical))
+        if not candidate_ids:
+            return []
+        
+        # Only the candidates need their content and filename (plus their
+        # full-precision vectors when they still need an exact score)
+        # Content is shared, so the filename and document id come from this user's copy
+        placeholders = ",".join("?" * len(candidate_ids))
+        owner_filter = "AND d.user_id = ?" if user_id is not None else ""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT c.id, c.content, d.id, d.filename,
+                       c.embedding, c.dtype, c.dim, c.segment_id, c.segment_row
+                FROM chunks c
+                JOIN documents d ON d.content_id = c.document_id {owner_filter}
+                WHERE c.id IN ({placeholders})
+            """, ([user_id] if user_id is not None else []) + candidate_ids)
+            rows = {row[0]: row for row in cursor.fetchall()}
+        
+        if rerank or lexical:
+            # Compressed first-pass scores and lexical-only hits both lack a true cosine
+            present = [chunk_id for chunk_id in candidate_ids if chunk_id in rows]
+            if not present:
+                return []
+            embeddings = self._decode_rows([(rows[c][0], rows[c][2]) + rows[c][4:] for c in present])
+            scores = normalize_rows(embeddings) @ normalize_rows(query_embedding)[0]
+            exact = dict(zip(present, scores.tolist()))
+            if rerank:
+                hits = sorted(((c, exact[c]) for c, _ in hits if c in exact), key=lambda hit: hit[1], reverse=True)
+            if lexical:
+                fused = reciprocal_rank_fusion([[chunk_id for chunk_id, _ in hits[:depth]], lexical])
+                hits = [(chunk_id, exact[chunk_id]) for chunk_id, _ in fused if chunk_id in exact]
+        
+        results = []
+        for chunk_id, similarity in hits[:top_k]:
+            if chunk_id not in rows:
+                continue
+            _, content, doc_id, filename = rows[chunk_id][:4]
+            results.append({
+                'chunk_id': chunk_id,
+                'content': content,
+                'similarity': similarity,
+                'document_id': doc_id,
+                'filename': filename
+            })
+        
+        return results
+    
+    def _search_fulltext(self, query_text: str, limit: int, user_id: Optional[int] = None) -> List[str]:
+        """Chunk ids matching any term of query_text, best BM25 score first"""
+        query = fts_query(query_text)
+        if not query:
+            return []
+        
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if user_id is not None:
+                cursor.execute("""
+                    SELECT c.id FROM chunks_fts
+                    JOIN chunks c ON c.fts_rowid = chunks_fts.rowid
+                    JOIN documents d ON d.content_id = c.document_id
+                    WHERE chunks_fts MATCH ? AND d.user_id = ?
+                    ORDER BY bm25(chunks_fts)
+                    LIMIT ?
+                """, (query, user_id, limit))
+            else:
+                cursor.execute("""
+                    SELECT c.id FROM chunks_fts
+                    JOIN chunks c ON c.fts_rowid = chunks_fts.rowid
+                    WHERE chunks_fts MATCH ?
+                    ORDER BY bm25(chunks_fts)
+                    LIMIT ?
+                """, (query, limit))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def _has_unsegmented_chunks(self) -> bool:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM chunks WHERE segment_id IS NULL LIMIT 1")
+            return cursor.fetchone() is not None
+    
+    def _search_unsegmented(self, query_embedding: np.ndarray, top_k: int,
+                            user_id: Optional[int] = None, batch_size: int = 4096) -> List[tuple]:
+        """Exact scan over the chunks whose vectors are not in segments yet (mmap storage mid-migration)"""
+        owner_join = "JOIN documents d ON d.content_id = c.document_id AND d.user_id = ?" if user_id is not None else ""
+        query = normalize_rows(query_embedding)[0]
+        hits = []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT DISTINCT c.id, c.document_id, c.embedding, c.dtype, c.dim, c.segment_id, c.segment_row
+                FROM chunks c {owner_join}
+                WHERE c.segment_id IS NULL
+            """, (user_id,) if user_id is not None else ())
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                scores = normalize_rows(self._decode_rows(rows)) @ query
+                for i in np.argsort(-scores)[:top_k]:
+                    hits.append((rows[i][0], float(scores[i])))
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:top_k]
+    
+    @staticmethod
+    def _merge_hits(first: List[tuple], second: List[tuple], top_k: int) -> List[tuple]:
+        """Best top_k of two (chunk_id, score) lists; a row moved mid-search may appear in both"""
+        best: Dict[str, float] = {}
+        for chunk_id, score in first + second:
+            best[chunk_id] = max(score, best.get(chunk_id, score))
+        return sorted(best.items(), key=lambda hit: hit[1], reverse=True)[:top_k]
+    
+    def _owned_contents(self, user_id: int) -> List[str]:
+        """Content ids of every document the user owns"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT content_id FROM documents WHERE user_id = ?", (user_id,))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def _get_index(self, user_id: Optional[int]):
+        """Return the resident index for a user, building it from the database on first use"""
+        with self._index_lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._load_index(user_id)
+                self._indexes[user_id] = index
+            return index
+    
+    def _loaded_indexes(self, *user_ids: Optional[int]) -> List:
+        """Indexes that contain rows owned by any of user_ids and are already resident"""
+        with self._index_lock:
+            keys = set(user_ids) | {None}
+            return [index for key, index in self._indexes.items() if key in keys]
+    
+    def _load_index(self, user_id: Optional[int]):
+        """Build the configured index from the stored embeddings of a user (or of everyone)"""
+        if self.index_type == "ivf":
+            name = f"ivf_user_{user_id}.npz" if user_id is not None else "ivf_shared.npz"
+            index = IVFFlatIndex(path=os.path.join(self.index_dir, name))
+            for chunk_ids, document_ids, embeddings in self.iter_embeddings(user_id):
+                index.add(chunk_ids, document_ids, embeddings, train=False)
+            index.train_if_needed()
+            return index
+        
+        if self.quantization != "none":
+            if self.quantizer is None:
+                self._train_quantizer()
+            if self.quantizer is not None:
+                return self._load_quantized_index(user_id)
+        
+        index = FlatIndex()
+        for chunk_ids, document_ids, embeddings in self.iter_embeddings(user_id):
+            index.add(chunk_ids, document_ids, embeddings)
+        return index
+    
+    def iter_embeddings(self, user_id: Optional[int] = None, batch_size: int = 4096):
+        """Yield (chunk_ids, document_ids, embeddings) batches for a user's chunks, from either storage engine"""
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
-            # Get all chunks with their embeddings, filtered by user if specified
             if user_id is not None:
                 cursor.execute("""
-                    SELECT c.id, c.content, c.embedding, c.document_id, d.filename
+                    SELECT c.id, c.document_id, c.embedding, c.dtype, c.dim, c.segment_id, c.segment_row
                     FROM chunks c
-                    JOIN documents d ON c.document_id = d.id
+                    JOIN documents d ON d.content_id = c.document_id
                     WHERE d.user_id = ?
                 """, (user_id,))
             else:
                 cursor.execute("""
-                    SELECT c.id, c.content, c.embedding, c.document_id, d.filename
+                    SELECT c.id, c.document_id, c.embedding, c.dtype, c.dim, c.segment_id, c.segment_row
                     FROM chunks c
-                    JOIN documents d ON c.document_id = d.id
+                    JOIN document_contents dc ON c.document_id = dc.id
                 """)
             
-            results = []
-            for row in cursor.fetchall():
-                chunk_id, content, embedding_blob, doc_id, filename = row
-                stored_embedding = pickle.loads(embedding_blob)
-                
-                # Calculate cosine similarity
-                similarity = self._cosine_similarity(query_embedding, stored_embedding)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
                 
-                results.append({
-                    'chunk_id': chunk_id,
-                    'content': content,
-                    'similarity': float(similarity),
-                    'document_id': doc_id,
-                    'filename': filename
-                })
+                yield [row[0] for row in rows], [row[1] for row in rows], self._decode_rows(rows)
+    
+    def _iter_content_embeddings(self, content_id: str, batch_size: int = 4096):
+        """Yield (chunk_ids, content_ids, embeddings) batches for one stored content"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, document_id, embedding, dtype, dim, segment_id, segment_row
+                FROM chunks WHERE document_id = ?
+            """, (content_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows], [row[1] for row in rows], self._decode_rows(rows)
+    
+    def _load_quantized_index(self, user_id: Optional[int], batch_size: int = 4096) -> QuantizedIndex:
+        """Build a QuantizedIndex from stored codes, encoding rows that have none yet on the fly"""
+        index = QuantizedIndex(self.quantizer)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
             
-            # Sort by similarity and return top_k
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            return results[:top_k]
+            # Codes from an older quantizer are treated as missing
+            columns = """
+                SELECT c.id, c.document_id, CASE WHEN c.quantizer_id = ? THEN c.code END,
+                       c.embedding, c.dtype, c.dim, c.segment_id, c.segment_row
+                FROM chunks c
+            """
+            if user_id is not None:
+                cursor.execute(columns + " JOIN documents d ON d.content_id = c.document_id WHERE d.user_id = ?",
+                               (self.quantizer_id, user_id))
+            else:
+                cursor.execute(columns + " JOIN document_contents dc ON c.document_id = dc.id", (self.quantizer_id,))
+            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                
+                coded = [row for row in rows if row[2] is not None]
+                if coded:
+                    codes = np.frombuffer(b"".join(row[2] for row in coded), dtype=self.quantizer.code_dtype)
+                    index.add_encoded([row[0] for row in coded], [row[1] for row in coded],
+                                      codes.reshape(len(coded), self.quantizer.code_size))
+                
+                uncoded = [(row[0], row[1]) + row[3:] for row in rows if row[2] is None]
+                if uncoded:
+                    index.add([row[0] for row in uncoded], [row[1] for row in uncoded], self._decode_rows(uncoded))
+        
+        return index
+    
+    def _load_quantizer(self):
+        """Load the most recently trained quantizer of the configured kind, if any"""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT id, state FROM quantizers WHERE kind = ? ORDER BY id DESC LIMIT 1", (self.quantization,)
+            ).fetchone()
+        if row:
+            self.quantizer_id = row[0]
+            self.quantizer = deserialize_quantizer(self.quantization, row[1])
     
-    def _cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Calculate cosine similarity between two vectors"""
-        dot_product = np.dot(vec1, vec2)
-        norm_vec1 = np.linalg.norm(vec1)
-        norm_vec2 = np.linalg.norm(vec2)
+    def _train_quantizer(self) -> bool:
+        """Train the configured quantizer on a random sample of stored embeddings"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT id, document_id, embedding, dtype, dim, segment_id, segment_row
+                FROM chunks ORDER BY RANDOM() LIMIT ?
+            """, (QUANTIZER_TRAIN_SAMPLE,)).fetchall()
+        if len(rows) < QUANTIZER_MIN_TRAIN_SIZE:
+            return False
         
-        if norm_vec1 == 0 or norm_vec2 == 0:
-            return 0.0
+        quantizer = QUANTIZERS[self.quantization]().train(self._decode_rows(rows))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO quantizers (kind, state) VALUES (?, ?)",
+                           (self.quantization, serialize_quantizer(quantizer)))
+            conn.commit()
+            self.quantizer_id = cursor.lastrowid
+        self.quantizer = quantizer
+        return True
+    
+    def find_embeddings(self, chunks: List[str], model_name: str,
+                        batch_size: int = 500) -> Dict[str, np.ndarray]:
+        """Stored embeddings for any of these chunk texts already embedded with model_name.
+        
+        Returns {chunk_content_hash: embedding}; the chunk rows themselves are the
+        cache, so it costs no extra storage and covers every stored document.
+        """
+        hashes = list(dict.fromkeys(chunk_content_hash(chunk, model_name) for chunk in chunks))
+        found: Dict[str, np.ndarray] = {}
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(hashes), batch_size):
+                batch = hashes[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"""
+                    SELECT id, document_id, embedding, dtype, dim, segment_id, segment_row, content_hash
+                    FROM chunks
+                    WHERE id IN (
+                        SELECT MIN(id) FROM chunks WHERE content_hash IN ({placeholders}) GROUP BY content_hash
+                    )
+                """, batch)
+                rows = cursor.fetchall()
+                if not rows:
+                    continue
+                try:
+                    embeddings = self._decode_rows([row[:7] for row in rows])
+                except FileNotFoundError:
+                    continue  # segment retired by a concurrent merge; re-embedding is always safe
+                found.update((row[7], embedding) for row, embedding in zip(rows, embeddings))
+        return found
+    
+    def _decode_rows(self, rows: List[tuple]) -> np.ndarray:
+        """Decode the embedding columns of iter_embeddings rows; rows may come from either engine mid-migration"""
+        in_segments = [i for i, row in enumerate(rows) if row[5] is not None]
+        if not in_segments:
+            return np.stack([decode_embedding(row[2], row[3], row[4]) for row in rows])
+        
+        located = self.segments.read_rows([(rows[i][5], rows[i][6]) for i in in_segments])
+        if len(in_segments) == len(rows):
+            return located
         
-        return dot_product / (norm_vec1 * norm_vec2)
+        embeddings = np.empty((len(rows), located.shape[1]), dtype=np.float32)
+        embeddings[in_segments] = located
+        for i, row in enumerate(rows):
+            if row[5] is None:
+                embeddings[i] = decode_embedding(row[2], row[3], row[4])
+        return embeddings
     
     def list_documents(self, user_id: Optional[int] = None) -> List[Dict]:
         """List all stored documents, optionally filtered by user"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
             if user_id is not None:
                 cursor.execute("""
-                    SELECT id, filename, upload_date, chunk_count, document_hash
+                    SELECT id, filename, upload_date, chunk_count, document_hash, status
                     FROM documents
                     WHERE user_id = ?
                     ORDER BY upload_date DESC
                 """, (user_id,))
             else:
                 cursor.execute("""
-                    SELECT id, filename, upload_date, chunk_count, document_hash
+                    SELECT id, filename, upload_date, chunk_count, document_hash, status
                     FROM documents
                     ORDER BY upload_date DESC
                 """)
@@ -164,35 +933,70 @@ class VectorStore:
                     'filename': row[1],
                     'upload_date': row[2],
                     'chunk_count': row[3],
-                    'document_hash': row[4]
+                    'document_hash': row[4],
+                    'status': row[5]
                 })
             
             return documents
     
     def delete_document(self, document_id: str, user_id: Optional[int] = None) -> bool:
-        """Delete a document and all its chunks, optionally checking user ownership"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Delete a user's document; its chunks go too once no other user owns the same content"""
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
             
             # Check if document exists and belongs to user (if user_id specified)
             if user_id is not None:
-                cursor.execute("SELECT 1 FROM documents WHERE id = ? AND user_id = ?", 
+                cursor.execute("SELECT user_id, content_id FROM documents WHERE id = ? AND user_id = ?", 
                              (document_id, user_id))
             else:
-                cursor.execute("SELECT 1 FROM documents WHERE id = ?", (document_id,))
+                cursor.execute("SELECT user_id, content_id FROM documents WHERE id = ?", (document_id,))
             
-            if not cursor.fetchone():
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
                 return False
+            owner_id, content_id = row
             
-            # Delete document (chunks will cascade due to foreign key)
             cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
-            conn.commit()
+            cursor.execute("SELECT COUNT(*) FROM documents WHERE content_id = ?", (content_id,))
+            remaining_owners = cursor.fetchone()[0]
+            if not remaining_owners:
+                self._delete_content(cursor, content_id)
+            self._bump_corpus_version(cursor, [owner_id])
+            
+            with self._index_lock:
+                conn.commit()
+                if not remaining_owners:
+                    indexes = self._loaded_indexes(owner_id)
+                else:
+                    # Other owners (and the unscoped index) still see the content
+                    indexes = [self._indexes[owner_id]] if owner_id is not None and owner_id in self._indexes else []
+                for index in indexes:
+                    index.remove_document(content_id)
             
             return True
     
+    def _delete_content(self, cursor, content_id: str):
+        """Remove stored content and its chunks inside the caller's transaction"""
+        if self.segments is not None:
+            self.segments.release_document(cursor, content_id)
+        
+        # A contentless FTS5 table deletes by replaying the indexed text
+        cursor.execute("""
+            INSERT INTO chunks_fts (chunks_fts, rowid, content)
+            SELECT 'delete', fts_rowid, content FROM chunks
+            WHERE document_id = ? AND fts_rowid IS NOT NULL
+        """, (content_id,))
+        
+        # Delete chunks explicitly: foreign keys are not enforced on this
+        # connection, so ON DELETE CASCADE never fires
+        cursor.execute("DELETE FROM chunks WHERE document_id = ?", (content_id,))
+        cursor.execute("DELETE FROM document_contents WHERE id = ?", (content_id,))
+    
     def get_document_by_hash(self, document_hash: str, user_id: Optional[int] = None) -> Optional[Dict]:
         """Get document by hash, optionally filtered by user"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
             if user_id is not None:
@@ -220,14 +1024,14 @@ class VectorStore:
     
     def get_user_document_count(self, user_id: int) -> int:
         """Get number of documents for a user"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM documents WHERE user_id = ?", (user_id,))
             return cursor.fetchone()[0]
     
     def get_user_chunk_count(self, user_id: int) -> int:
         """Get total number of chunks for a user"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT SUM(chunk_count) FROM documents WHERE user_id = ?
@@ -235,9 +1039,34 @@ class VectorStore:
             result = cursor.fetchone()[0]
             return result if result is not None else 0
     
-    def migrate_existing_documents(self):
-        """Migrate existing documents to have user_id column (for upgrading existing databases)"""
-        with sqlite3.connect(self.db_path) as conn:
+    def migrate_existing_documents(self, batch_size: int = 1000) -> bool:
+        """Migrate existing databases: add the user_id column, re-encode pickled embeddings and so on.
+        
+        Only one process migrates at a time; returns False without doing
+        anything if another one holds the migration lock. Every step is safe to
+        rerun, so a migration that failed midway is completed by the next call.
+        """
+        holder = self._acquire_migration_lock()
+        if holder is None:
+            return False
+        try:
+            steps = [self._migrate_user_column, self.migrate_shared_contents,
+                     lambda: self.migrate_embedding_format(batch_size),
+                     lambda: self.migrate_fulltext(batch_size),
+                     lambda: self.migrate_content_hashes(batch_size)]
+            if self.segments is not None:
+                steps.append(lambda: self.migrate_to_segments(batch_size))
+            if self.quantization != "none":
+                steps.append(lambda: self.migrate_quantization(batch_size))
+            for step in steps:
+                step()
+                self._refresh_migration_lock(holder)
+        finally:
+            self._release_migration_lock(holder)
+        return True
+    
+    def _migrate_user_column(self):
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
             # Check if user_id column exists
@@ -255,4 +1084,226 @@ class VectorStore:
                 cursor.execute("CREATE INDEX idx_user_hash ON documents (user_id, document_hash)")
                 
                 conn.commit()
-                print("Database migrated to support user authentication")
\ No newline at end of file
+                print("Database migrated to support user authentication")
+    
+    def _acquire_migration_lock(self) -> Optional[str]:
+        """Take the migration lock (reclaiming one left by a dead process); returns the holder token or None"""
+        holder = str(uuid.uuid4())
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM migration_lock WHERE updated_at < datetime('now', ?)",
+                           (f"-{MIGRATION_LOCK_STALE_SECONDS} seconds",))
+            cursor.execute("INSERT OR IGNORE INTO migration_lock (id, holder) VALUES (1, ?)", (holder,))
+            acquired = cursor.rowcount == 1
+            conn.commit()
+        return holder if acquired else None
+    
+    def _refresh_migration_lock(self, holder: str):
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE migration_lock SET updated_at = CURRENT_TIMESTAMP WHERE holder = ?", (holder,))
+            conn.commit()
+    
+    def _release_migration_lock(self, holder: str):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM migration_lock WHERE holder = ?", (holder,))
+            conn.commit()
+    
+    def migrate_shared_contents(self) -> int:
+        """Collapse duplicate copies of the same file stored for different users into one shared content"""
+        with self.pool.connection() as conn:
+            duplicated = [row[0] for row in conn.execute("""
+                SELECT document_hash FROM document_contents
+                WHERE status = 'ready'
+                GROUP BY document_hash HAVING COUNT(*) > 1
+            """).fetchall()]
+        
+        merged = 0
+        for document_hash in duplicated:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    SELECT id FROM document_contents
+                    WHERE document_hash = ? AND status = 'ready'
+                    ORDER BY created_at, id
+                """, (document_hash,))
+                keep, *duplicates = [row[0] for row in cursor.fetchall()]
+                
+                moved_owners = []
+                for content_id in duplicates:
+                    cursor.execute("SELECT user_id FROM documents WHERE content_id = ?", (content_id,))
+                    moved_owners.extend(row[0] for row in cursor.fetchall())
+                    cursor.execute("UPDATE documents SET content_id = ? WHERE content_id = ?", (keep, content_id))
+                    self._delete_content(cursor, content_id)
+                
+                with self._index_lock:
+                    conn.commit()
+                    for index in self._loaded_indexes(*moved_owners):
+                        for content_id in duplicates:
+                            index.remove_document(content_id)
+                    for owner_id in set(moved_owners):
+                        index = self._indexes.get(owner_id) if owner_id is not None else None
+                        if index is not None:
+                            for chunk_ids, content_ids, embeddings in self._iter_content_embeddings(keep):
+                                index.add(chunk_ids, content_ids, embeddings)
+                merged += len(duplicates)
+        
+        if merged:
+            print(f"Merged {merged} duplicate document copies into shared content")
+        
+        return merged
+    
+    def migrate_embedding_format(self, batch_size: int = 1000) -> int:
+        """Convert pickled embedding rows to the raw format in small batches.
+        
+        Each batch commits on its own, so the store stays usable while the
+        migration runs; rows not yet converted are still decoded via pickle.
+        """
+        converted = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, embedding FROM chunks WHERE dtype IS NULL LIMIT ?", (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                updates = []
+                for chunk_id, embedding_blob in rows:
+                    embedding = np.asarray(pickle.loads(embedding_blob))
+                    updates.append((encode_embedding(embedding, self.embedding_dtype), len(embedding),
+                                    self.embedding_dtype, chunk_id))
+                
+                cursor.executemany(
+                    "UPDATE chunks SET embedding = ?, dim = ?, dtype = ? WHERE id = ?", updates
+                )
+                conn.commit()
+                converted += len(updates)
+        
+        if converted:
+            # Give the space freed by the smaller blobs back to the filesystem
+            with self.pool.connection() as conn:
+                conn.execute("VACUUM")
+            print(f"Converted {converted} embeddings to raw {self.embedding_dtype} storage")
+        
+        return converted
+    
+    def migrate_fulltext(self, batch_size: int = 1000) -> int:
+        """Add chunks stored before the full-text index existed to chunks_fts"""
+        indexed = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, content FROM chunks WHERE fts_rowid IS NULL LIMIT ?", (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                for chunk_id, content in rows:
+                    cursor.execute("INSERT INTO chunks_fts (content) VALUES (?)", (content,))
+                    cursor.execute("UPDATE chunks SET fts_rowid = ? WHERE id = ?", (cursor.lastrowid, chunk_id))
+                conn.commit()
+                indexed += len(rows)
+        
+        if indexed:
+            print(f"Added {indexed} chunks to the full-text index")
+        
+        return indexed
+    
+    def migrate_content_hashes(self, batch_size: int = 1000) -> int:
+        """Address chunks stored before the embedding cache existed (rows without a model_name can't be)"""
+        hashed = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, content, model_name FROM chunks
+                    WHERE content_hash IS NULL AND model_name IS NOT NULL
+                    LIMIT ?
+                """, (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                cursor.executemany("UPDATE chunks SET content_hash = ? WHERE id = ?",
+                                   [(chunk_content_hash(content, model_name), chunk_id)
+                                    for chunk_id, content, model_name in rows])
+                conn.commit()
+                hashed += len(rows)
+        
+        if hashed:
+            print(f"Added content hashes for {hashed} chunks")
+        
+        return hashed
+    
+    def migrate_to_segments(self, batch_size: int = 1000) -> int:
+        """Move embeddings still held as BLOBs into segment files (mmap storage engine)"""
+        moved = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    SELECT c.id, c.embedding, c.dtype, c.dim,
+                           (SELECT MIN(d.user_id) FROM documents d WHERE d.content_id = c.document_id)
+                    FROM chunks c
+                    WHERE c.segment_id IS NULL
+                    LIMIT ?
+                """, (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                by_user: Dict[Optional[int], List] = {}
+                for row in rows:
+                    by_user.setdefault(row[4], []).append(row)
+                
+                for owner_id, user_rows in by_user.items():
+                    embeddings = np.stack([decode_embedding(row[1], row[2], row[3]) for row in user_rows])
+                    locations = self.segments.append(cursor, owner_id, embeddings)
+                    cursor.executemany("""
+                        UPDATE chunks SET embedding = X'', dtype = ?, dim = ?, segment_id = ?, segment_row = ?
+                        WHERE id = ?
+                    """, [(self.embedding_dtype, embeddings.shape[1], segment_id, segment_row, row[0])
+                          for row, (segment_id, segment_row) in zip(user_rows, locations)])
+                
+                conn.commit()
+                moved += len(rows)
+        
+        self._unsegmented = False
+        if moved:
+            with self.pool.connection() as conn:
+                conn.execute("VACUUM")
+            print(f"Moved {moved} embeddings into memory-mapped segments")
+        
+        return moved
+    
+    def migrate_quantization(self, batch_size: int = 1000) -> int:
+        """Encode every chunk without a current code, training the quantizer first if needed"""
+        if self.quantizer is None and not self._train_quantizer():
+            return 0
+        
+        encoded = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, document_id, embedding, dtype, dim, segment_id, segment_row
+                    FROM chunks WHERE quantizer_id IS NULL OR quantizer_id != ?
+                    LIMIT ?
+                """, (self.quantizer_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                codes = self.quantizer.encode(normalize_rows(self._decode_rows(rows)))
+                cursor.executemany("UPDATE chunks SET code = ?, quantizer_id = ? WHERE id = ?",
+                                   [(code.tobytes(), self.quantizer_id, row[0]) for row, code in zip(rows, codes)])
+                conn.commit()
+                encoded += len(rows)
+        
+        if encoded:
+            print(f"Encoded {encoded} embeddings with the {self.quantization} quantizer")
+        
+        return encoded